@@ -32,6 +32,7 @@ target_metadata = db.metadata
 
 # Import all models to register them
 from bill.db import *
+from directory.db import *
 from common.db import *
 from elec.db import *
 from profile.db import *
@@ -0,0 +1,54 @@
+"""add pairwise balance ledger
+
+Revision ID: 1e0b2074eb7b
+Revises: fcfb92a3454f
+Create Date: 2026-10-18 18:10:42.518903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1e0b2074eb7b'
+down_revision: Union[str, Sequence[str], None] = 'fcfb92a3454f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'balance',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('uid', sa.String(32), nullable=False),
+        sa.Column('counterpart_uid', sa.String(32), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.UniqueConstraint('uid', 'counterpart_uid'),
+        schema='bill'
+    )
+    # backfill from the outstanding shares of existing bills
+    op.execute("""
+        WITH debt AS (
+            SELECT a.uid AS debtor, p.uid AS creditor, a.diff AS amount
+            FROM bill.bill_amount a
+            JOIN bill.bill b ON b.id = a.bill_id
+            JOIN bill.party_user p ON p.party_id = b.party_id
+            WHERE NOT b.deleted AND NOT a.completed AND a.uid <> p.uid
+        )
+        INSERT INTO bill.balance (uid, counterpart_uid, amount)
+        SELECT uid, counterpart_uid, SUM(amount)
+        FROM (
+            SELECT debtor AS uid, creditor AS counterpart_uid, amount FROM debt
+            UNION ALL
+            SELECT creditor, debtor, -amount FROM debt
+        ) pairs
+        GROUP BY uid, counterpart_uid
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('balance', schema='bill')
@@ -0,0 +1,41 @@
+"""make profile account uid unique
+
+Revision ID: 21aef8f12c48
+Revises: cec39a72db87
+Create Date: 2026-10-18 19:21:25.930157
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '21aef8f12c48'
+down_revision: Union[str, Sequence[str], None] = 'cec39a72db87'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # each account row holds a user's own credentials, so duplicates are left
+    # for whoever runs the upgrade to resolve
+    duplicates = op.get_bind().execute(sa.text("""
+        SELECT uid, COUNT(*) FROM profile.account
+        GROUP BY uid HAVING COUNT(*) > 1
+        ORDER BY uid LIMIT 20
+    """)).all()
+    if duplicates:
+        rows = '\n'.join(f'  {uid}: {copies} rows' for uid, copies in duplicates)
+        raise RuntimeError(
+            'profile.account has several rows per uid, remove them before upgrading'
+            f' (first {len(duplicates)} shown):\n{rows}'
+        )
+    op.create_unique_constraint('uq_profile_account_uid', 'account', ['uid'], schema='profile')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_profile_account_uid', 'account', schema='profile')
@@ -0,0 +1,36 @@
+"""add version counters for conditional requests
+
+Revision ID: 3f9d0b6e4a12
+Revises: 8c3e5a91d2f7
+Create Date: 2026-10-18 21:54:09.615380
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9d0b6e4a12'
+down_revision: Union[str, Sequence[str], None] = '8c3e5a91d2f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('CREATE SCHEMA IF NOT EXISTS common')
+    op.create_table(
+        'version',
+        sa.Column('scope', sa.Text(), primary_key=True),
+        sa.Column('key', sa.Text(), primary_key=True),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        schema='common'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('version', schema='common')
+    op.execute('DROP SCHEMA IF EXISTS common')
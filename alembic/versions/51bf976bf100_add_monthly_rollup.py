@@ -0,0 +1,58 @@
+"""add monthly spending rollup
+
+Revision ID: 51bf976bf100
+Revises: 21aef8f12c48
+Create Date: 2026-10-18 20:04:51.337902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '51bf976bf100'
+down_revision: Union[str, Sequence[str], None] = '21aef8f12c48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'monthly_rollup',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('uid', sa.String(32), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('counterpart_uid', sa.String(32), nullable=False),
+        sa.Column('spent', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.Column('received', sa.Numeric(precision=12, scale=2), nullable=False),
+        sa.Column('bills', sa.Integer(), nullable=False),
+        sa.UniqueConstraint('uid', 'month', 'counterpart_uid', name='uq_bill_monthly_rollup_uid_month_counterpart_uid'),
+        schema='bill'
+    )
+    # backfill from the existing bills, months as in bill.util.STATS_TIMEZONE
+    op.execute("""
+        WITH share AS (
+            SELECT a.uid, p.uid AS payer, a.price + a.diff AS amount,
+                   date_trunc('month', timezone('Asia/Shanghai', b.trade_time))::date AS month
+            FROM bill.bill_amount a
+            JOIN bill.bill b ON b.id = a.bill_id
+            JOIN bill.party_user p ON p.party_id = b.party_id
+            WHERE NOT b.deleted
+        )
+        INSERT INTO bill.monthly_rollup (uid, month, counterpart_uid, spent, received, bills)
+        SELECT uid, month, counterpart_uid, SUM(spent), SUM(received), SUM(bills)
+        FROM (
+            SELECT uid, month, payer AS counterpart_uid, amount AS spent, 0 AS received, 1 AS bills FROM share
+            UNION ALL
+            SELECT payer, month, uid, 0, amount, 0 FROM share WHERE uid <> payer
+        ) entries
+        GROUP BY uid, month, counterpart_uid
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('monthly_rollup', schema='bill')
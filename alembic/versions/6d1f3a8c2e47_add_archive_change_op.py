@@ -0,0 +1,32 @@
+"""log bill archival in the change log
+
+Revision ID: 6d1f3a8c2e47
+Revises: b2c7f4e90d35
+Create Date: 2026-10-19 02:14:05.662931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d1f3a8c2e47'
+down_revision: Union[str, Sequence[str], None] = 'b2c7f4e90d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("ALTER TYPE changeop ADD VALUE IF NOT EXISTS 'archive'")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # enum values cannot be dropped, so the type is rebuilt without it
+    op.execute("DELETE FROM bill.change_log WHERE op = 'archive'")
+    op.execute("ALTER TYPE changeop RENAME TO changeop_old")
+    op.execute("CREATE TYPE changeop AS ENUM ('create', 'complete', 'delete')")
+    op.execute("ALTER TABLE bill.change_log ALTER COLUMN op TYPE changeop USING op::text::changeop")
+    op.execute("DROP TYPE changeop_old")
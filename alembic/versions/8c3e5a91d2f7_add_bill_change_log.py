@@ -0,0 +1,40 @@
+"""add bill change log outbox
+
+Revision ID: 8c3e5a91d2f7
+Revises: 51bf976bf100
+Create Date: 2026-10-18 21:12:37.480215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c3e5a91d2f7'
+down_revision: Union[str, Sequence[str], None] = '51bf976bf100'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'change_log',
+        sa.Column('id', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('xid', sa.BigInteger(), nullable=False, server_default=sa.text("pg_current_xact_id()::text::bigint")),
+        sa.Column('bill_id', sa.Integer(), nullable=False),
+        sa.Column('uids', postgresql.ARRAY(sa.Text()), nullable=False),
+        sa.Column('op', sa.Enum('create', 'complete', 'delete', name='changeop'), nullable=False),
+        schema='bill'
+    )
+    op.create_index('ix_bill_change_log_uids', 'change_log', ['uids'], postgresql_using='gin', schema='bill')
+    op.create_index('ix_bill_change_log_xid_id', 'change_log', ['xid', 'id'], schema='bill')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('change_log', schema='bill')
+    sa.Enum(name='changeop').drop(op.get_bind())
@@ -0,0 +1,53 @@
+"""add full-text search over bill titles and descriptions
+
+Revision ID: a7e21c4f9b30
+Revises: 3f9d0b6e4a12
+Create Date: 2026-10-18 22:31:46.208117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e21c4f9b30'
+down_revision: Union[str, Sequence[str], None] = '3f9d0b6e4a12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# bill.db.SEARCH_DOCUMENT at this revision
+SEARCH_DOCUMENT = "coalesce(title, '') || ' ' || coalesce(description, '')"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # stored generated column: rewrites bill.bill once
+    op.add_column(
+        'bill',
+        sa.Column(
+            'search',
+            postgresql.TSVECTOR(),
+            sa.Computed(f"to_tsvector('simple', {SEARCH_DOCUMENT})", persisted=True)
+        ),
+        schema='bill'
+    )
+    op.create_index('ix_bill_bill_search', 'bill', ['search'], postgresql_using='gin', schema='bill')
+    op.create_index(
+        'ix_bill_bill_search_trgm',
+        'bill',
+        [sa.text(f"({SEARCH_DOCUMENT}) gin_trgm_ops")],
+        postgresql_using='gin',
+        schema='bill'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_bill_bill_search_trgm', 'bill', schema='bill')
+    op.drop_index('ix_bill_bill_search', 'bill', schema='bill')
+    op.drop_column('bill', 'search', schema='bill')
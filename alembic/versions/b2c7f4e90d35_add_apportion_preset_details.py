@@ -0,0 +1,40 @@
+"""add denormalized details to apportion_preset
+
+Revision ID: b2c7f4e90d35
+Revises: e5b84d2c1f67
+Create Date: 2026-10-19 00:41:27.318264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2c7f4e90d35'
+down_revision: Union[str, Sequence[str], None] = 'e5b84d2c1f67'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('apportion_preset', sa.Column('details', postgresql.JSONB()), schema='bill')
+    op.execute("""
+        UPDATE bill.apportion_preset p
+        SET details = d.details
+        FROM (
+            SELECT apportion_preset_id,
+                jsonb_agg(jsonb_build_object('uid', uid, 'value', value::text) ORDER BY id) AS details
+            FROM bill.apportion_preset_detail
+            GROUP BY apportion_preset_id
+        ) d
+        WHERE d.apportion_preset_id = p.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('apportion_preset', 'details', schema='bill')
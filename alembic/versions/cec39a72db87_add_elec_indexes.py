@@ -0,0 +1,39 @@
+"""add indexes and unique constraints to the elec schema
+
+Revision ID: cec39a72db87
+Revises: d4247af4afcc
+Create Date: 2026-10-18 19:21:02.648310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cec39a72db87'
+down_revision: Union[str, Sequence[str], None] = 'd4247af4afcc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_unique_constraint(
+        'uq_elec_elec_building_location',
+        'elec_building',
+        ['area_id', 'apartment_id', 'floor_id', 'dormitory_id'],
+        schema='elec'
+    )
+    op.create_index(
+        'ix_elec_elec_stat_building_id_search_time',
+        'elec_stat',
+        ['building_id', 'search_time'],
+        schema='elec'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_elec_elec_stat_building_id_search_time', 'elec_stat', schema='elec')
+    op.drop_constraint('uq_elec_elec_building_location', 'elec_building', schema='elec')
@@ -0,0 +1,95 @@
+"""add indexes and unique constraints to the bill schema
+
+Revision ID: d4247af4afcc
+Revises: 1e0b2074eb7b
+Create Date: 2026-10-18 19:20:37.104512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4247af4afcc'
+down_revision: Union[str, Sequence[str], None] = '1e0b2074eb7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def check_unique(table, columns):
+    # Duplicates here carry amounts or ratios, so which row is right is not
+    # ours to guess: stop before the constraint and name the keys to fix.
+    keys = ', '.join(columns)
+    duplicates = op.get_bind().execute(sa.text(f"""
+        SELECT {keys}, COUNT(*) AS copies FROM bill.{table}
+        GROUP BY {keys} HAVING COUNT(*) > 1
+        ORDER BY {keys} LIMIT 20
+    """)).all()
+    if duplicates:
+        rows = '\n'.join(f'  {tuple(row[:-1])}: {row[-1]} rows' for row in duplicates)
+        raise RuntimeError(
+            f'bill.{table} has duplicate ({keys}) rows, remove them before upgrading'
+            f' (first {len(duplicates)} shown):\n{rows}'
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    check_unique('bill_amount', ['bill_id', 'uid'])
+    check_unique('apportion', ['bill_id'])
+    check_unique('apportion_preset_detail', ['apportion_preset_id', 'uid'])
+    # a repeated membership means nothing more than the first one
+    op.execute("""
+        DELETE FROM bill.party_user p
+        USING bill.party_user kept
+        WHERE kept.party_id = p.party_id AND kept.uid = p.uid AND kept.id < p.id
+    """)
+    # no foreign keys on purpose: bill and bill_amount are meant to be
+    # partitioned later
+    op.create_index('ix_bill_bill_party_id', 'bill', ['party_id'], schema='bill')
+    op.create_index('ix_bill_bill_counterparty_id', 'bill', ['counterparty_id'], schema='bill')
+    op.create_index(
+        'ix_bill_bill_live_trade_time',
+        'bill',
+        [sa.text('trade_time DESC'), sa.text('id DESC')],
+        schema='bill',
+        postgresql_where=sa.text('NOT deleted')
+    )
+    op.create_unique_constraint(
+        'uq_bill_bill_amount_bill_id_uid', 'bill_amount', ['bill_id', 'uid'], schema='bill'
+    )
+    op.create_index('ix_bill_bill_amount_uid', 'bill_amount', ['uid', 'bill_id'], schema='bill')
+    op.create_unique_constraint('uq_bill_apportion_bill_id', 'apportion', ['bill_id'], schema='bill')
+    op.create_index(
+        'ix_bill_apportion_detail_apportion_id', 'apportion_detail', ['apportion_id'], schema='bill'
+    )
+    op.create_index('ix_bill_apportion_preset_oid', 'apportion_preset', ['oid'], schema='bill')
+    op.create_unique_constraint(
+        'uq_bill_apportion_preset_detail_preset_id_uid',
+        'apportion_preset_detail',
+        ['apportion_preset_id', 'uid'],
+        schema='bill'
+    )
+    op.create_unique_constraint(
+        'uq_bill_party_user_party_id_uid', 'party_user', ['party_id', 'uid'], schema='bill'
+    )
+    op.create_index('ix_bill_party_user_uid', 'party_user', ['uid', 'party_id'], schema='bill')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_bill_party_user_uid', 'party_user', schema='bill')
+    op.drop_constraint('uq_bill_party_user_party_id_uid', 'party_user', schema='bill')
+    op.drop_constraint(
+        'uq_bill_apportion_preset_detail_preset_id_uid', 'apportion_preset_detail', schema='bill'
+    )
+    op.drop_index('ix_bill_apportion_preset_oid', 'apportion_preset', schema='bill')
+    op.drop_index('ix_bill_apportion_detail_apportion_id', 'apportion_detail', schema='bill')
+    op.drop_constraint('uq_bill_apportion_bill_id', 'apportion', schema='bill')
+    op.drop_index('ix_bill_bill_amount_uid', 'bill_amount', schema='bill')
+    op.drop_constraint('uq_bill_bill_amount_bill_id_uid', 'bill_amount', schema='bill')
+    op.drop_index('ix_bill_bill_live_trade_time', 'bill', schema='bill')
+    op.drop_index('ix_bill_bill_counterparty_id', 'bill', schema='bill')
+    op.drop_index('ix_bill_bill_party_id', 'bill', schema='bill')
@@ -0,0 +1,188 @@
+"""partition bill and bill_amount by archived and trade_time
+
+Revision ID: e5b84d2c1f67
+Revises: a7e21c4f9b30
+Create Date: 2026-10-18 23:17:52.904431
+
+"""
+from typing import Sequence, Union
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b84d2c1f67'
+down_revision: Union[str, Sequence[str], None] = 'a7e21c4f9b30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# bill.db.SEARCH_DOCUMENT and bill.util.STATS_TIMEZONE at this revision
+SEARCH_DOCUMENT = "coalesce(title, '') || ' ' || coalesce(description, '')"
+TIMEZONE = 'Asia/Shanghai'
+BILL_COLUMNS = "id, trade_time, title, description, price, party_id, counterparty_id, deleted"
+AMOUNT_COLUMNS = "id, bill_id, uid, price, diff, completed"
+
+
+def bill_columns(id_default):
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text(id_default), nullable=False),
+        sa.Column('trade_time', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('title', sa.Text()),
+        sa.Column('description', sa.Text()),
+        sa.Column('price', sa.Numeric(precision=10, scale=2)),
+        sa.Column('party_id', sa.Integer()),
+        sa.Column('counterparty_id', sa.Integer()),
+        sa.Column('deleted', sa.Boolean()),
+        sa.Column(
+            'search',
+            postgresql.TSVECTOR(),
+            sa.Computed(f"to_tsvector('simple', {SEARCH_DOCUMENT})", persisted=True)
+        )
+    ]
+
+
+def amount_columns(id_default):
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text(id_default), nullable=False),
+        sa.Column('bill_id', sa.Integer()),
+        sa.Column('uid', sa.String(32)),
+        sa.Column('price', sa.Numeric(precision=10, scale=2)),
+        sa.Column('diff', sa.Numeric(precision=10, scale=2)),
+        sa.Column('completed', sa.Boolean())
+    ]
+
+
+def create_bill_indexes():
+    op.create_index('ix_bill_bill_party_id', 'bill', ['party_id'], schema='bill')
+    op.create_index('ix_bill_bill_counterparty_id', 'bill', ['counterparty_id'], schema='bill')
+    op.create_index(
+        'ix_bill_bill_live_trade_time',
+        'bill',
+        [sa.text('trade_time DESC'), sa.text('id DESC')],
+        postgresql_where=sa.text('NOT deleted'),
+        schema='bill'
+    )
+    op.create_index('ix_bill_bill_search', 'bill', ['search'], postgresql_using='gin', schema='bill')
+    op.create_index(
+        'ix_bill_bill_search_trgm',
+        'bill',
+        [sa.text(f"({SEARCH_DOCUMENT}) gin_trgm_ops")],
+        postgresql_using='gin',
+        schema='bill'
+    )
+    op.create_index('ix_bill_bill_amount_uid', 'bill_amount', ['uid', 'bill_id'], schema='bill')
+
+
+def replace_tables(suffix):
+    # Swap the filled bill{suffix} and bill_amount{suffix} tables in for the
+    # current ones, keeping the id sequences and the constraint names
+    op.execute(f"ALTER SEQUENCE bill.bill_id_seq OWNED BY bill.bill{suffix}.id")
+    op.execute(f"ALTER SEQUENCE bill.bill_amount_id_seq OWNED BY bill.bill_amount{suffix}.id")
+    op.drop_table('bill_amount', schema='bill')
+    op.drop_table('bill', schema='bill')
+    for table in ('bill', 'bill_amount'):
+        op.rename_table(f'{table}{suffix}', table, schema='bill')
+        op.execute(f"ALTER TABLE bill.{table} RENAME CONSTRAINT {table}{suffix}_pkey TO {table}_pkey")
+
+
+def year_bound(year):
+    return f"'{year}-01-01 00:00:00 {TIMEZONE}'"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a unique key of a partitioned table must include the partition key
+    op.create_table(
+        'bill_partitioned',
+        *bill_columns("nextval('bill.bill_id_seq')"),
+        sa.Column('archived', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.PrimaryKeyConstraint('id', 'trade_time', 'archived'),
+        schema='bill',
+        postgresql_partition_by='LIST (archived)'
+    )
+    op.create_table(
+        'bill_amount_partitioned',
+        *amount_columns("nextval('bill.bill_amount_id_seq')"),
+        sa.Column('trade_time', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('archived', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.PrimaryKeyConstraint('id', 'trade_time', 'archived'),
+        schema='bill',
+        postgresql_partition_by='LIST (archived)'
+    )
+
+    # hot and archive levels, one partition per year of the existing bills
+    # up to next year, and a default partition for anything else
+    first, last = op.get_bind().execute(sa.text(
+        f"SELECT min(extract(year FROM timezone('{TIMEZONE}', trade_time)))::int, "
+        f"max(extract(year FROM timezone('{TIMEZONE}', trade_time)))::int "
+        "FROM bill.bill"
+    )).one()
+    this_year = datetime.now().year
+    years = range(min(first or this_year, this_year), max(last or this_year, this_year + 1) + 1)
+    for table in ('bill', 'bill_amount'):
+        for level, archived in (('hot', 'false'), ('archive', 'true')):
+            parent = f'bill.{table}_{level}'
+            op.execute(
+                f"CREATE TABLE {parent} PARTITION OF bill.{table}_partitioned "
+                f"FOR VALUES IN ({archived}) PARTITION BY RANGE (trade_time)"
+            )
+            op.execute(f"CREATE TABLE {parent}_default PARTITION OF {parent} DEFAULT")
+            for year in years:
+                op.execute(
+                    f"CREATE TABLE {parent}_{year} PARTITION OF {parent} "
+                    f"FOR VALUES FROM ({year_bound(year)}) TO ({year_bound(year + 1)})"
+                )
+
+    # everything starts hot; script/archive_bills.py moves the old rows
+    op.execute(f"""
+        INSERT INTO bill.bill_partitioned ({BILL_COLUMNS}, archived)
+        SELECT {BILL_COLUMNS}, false FROM bill.bill
+    """)
+    op.execute(f"""
+        INSERT INTO bill.bill_amount_partitioned ({AMOUNT_COLUMNS}, trade_time, archived)
+        SELECT {', '.join(f'a.{column}' for column in AMOUNT_COLUMNS.split(', '))}, b.trade_time, false
+        FROM bill.bill_amount a
+        JOIN bill.bill b ON b.id = a.bill_id
+    """)
+
+    replace_tables('_partitioned')
+    op.create_unique_constraint(
+        'uq_bill_bill_amount_bill_id_uid',
+        'bill_amount',
+        ['bill_id', 'uid', 'trade_time', 'archived'],
+        schema='bill'
+    )
+    create_bill_indexes()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table(
+        'bill_unpartitioned',
+        *bill_columns("nextval('bill.bill_id_seq')"),
+        sa.PrimaryKeyConstraint('id'),
+        schema='bill'
+    )
+    op.create_table(
+        'bill_amount_unpartitioned',
+        *amount_columns("nextval('bill.bill_amount_id_seq')"),
+        sa.PrimaryKeyConstraint('id'),
+        schema='bill'
+    )
+    op.execute(f"""
+        INSERT INTO bill.bill_unpartitioned ({BILL_COLUMNS})
+        SELECT {BILL_COLUMNS} FROM bill.bill
+    """)
+    op.execute(f"""
+        INSERT INTO bill.bill_amount_unpartitioned ({AMOUNT_COLUMNS})
+        SELECT {AMOUNT_COLUMNS} FROM bill.bill_amount
+    """)
+
+    # dropping the partitioned tables drops their partitions
+    replace_tables('_unpartitioned')
+    op.create_unique_constraint('uq_bill_bill_amount_bill_id_uid', 'bill_amount', ['bill_id', 'uid'], schema='bill')
+    create_bill_indexes()
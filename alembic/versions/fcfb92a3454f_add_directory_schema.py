@@ -0,0 +1,69 @@
+"""add directory schema mirroring Logto
+
+Revision ID: fcfb92a3454f
+Revises: 191b12ff6a94
+Create Date: 2026-10-18 17:02:11.284517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fcfb92a3454f'
+down_revision: Union[str, Sequence[str], None] = '191b12ff6a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('CREATE SCHEMA IF NOT EXISTS directory')
+    op.create_table(
+        'users',
+        sa.Column('id', sa.String(32), primary_key=True),
+        sa.Column('username', sa.Text()),
+        sa.Column('updated_at', sa.BigInteger()),
+        sa.Column('data', postgresql.JSONB()),
+        schema='directory'
+    )
+    op.create_index(
+        'ix_directory_users_username_prefix',
+        'users',
+        [sa.text('lower(username) text_pattern_ops')],
+        schema='directory'
+    )
+    op.create_table(
+        'organizations',
+        sa.Column('id', sa.String(32), primary_key=True),
+        sa.Column('name', sa.Text()),
+        sa.Column('data', postgresql.JSONB()),
+        schema='directory'
+    )
+    op.create_table(
+        'memberships',
+        sa.Column('organization_id', sa.String(32), primary_key=True),
+        sa.Column('uid', sa.String(32), primary_key=True),
+        schema='directory'
+    )
+    op.create_index('ix_directory_memberships_uid', 'memberships', ['uid'], schema='directory')
+    op.create_table(
+        'sync_state',
+        sa.Column('name', sa.Text(), primary_key=True),
+        sa.Column('synced_at', sa.DateTime(timezone=True)),
+        schema='directory'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sync_state', schema='directory')
+    op.drop_index('ix_directory_memberships_uid', 'memberships', schema='directory')
+    op.drop_table('memberships', schema='directory')
+    op.drop_table('organizations', schema='directory')
+    op.drop_index('ix_directory_users_username_prefix', 'users', schema='directory')
+    op.drop_table('users', schema='directory')
+    op.execute('DROP SCHEMA IF EXISTS directory')
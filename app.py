@@ -2,14 +2,18 @@ from flask import Flask
 from tomllib import load
 
 
+import logging
 import os
 
 
 from common.db import db
+from common.cache import init_caches
+from common.logto import logto
 from common.route import common
 from profile.route import profile
 from elec.route import elec
 from bill.route import bill
+from directory.route import directory
 
 
 # runtime configuration
@@ -24,6 +28,7 @@ app.register_blueprint(common)
 app.register_blueprint(elec)
 app.register_blueprint(profile)
 app.register_blueprint(bill)
+app.register_blueprint(directory)
 
 # db
 app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['database']['username']}:{config['database']['password']}@{config['database']['address']}/{config['database']['database']}"
@@ -31,6 +36,15 @@ db.init_app(app)
 
 # logto
 app.config['LOGTO'] = config['logto']
+logto.init_app(app)
+
+# directory mirror
+app.config['DIRECTORY'] = config.get('directory', {})
+
+# in-process caches, their stats are logged at INFO
+app.logger.setLevel(logging.INFO)
+app.config['CACHE'] = config.get('cache', {})
+init_caches(app)
 
 # used for debug
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from sqlalchemy import text
+from typing import Iterable
+
+
+from bill.db import db, Bill, BillAmount, ChangeOp
+from bill.util import STATS_TIMEZONE, log_changes
+
+
+# bill.bill and bill.bill_amount are LIST partitioned on `archived` into
+# <table>_hot and <table>_archive, each RANGE partitioned on trade_time into
+# one partition per year of STATS_TIMEZONE plus a default one
+PARTITIONED = (Bill, BillAmount)
+LEVELS = {"hot": False, "archive": True}
+# fully paid bills older than this many days are archived
+ARCHIVE_HORIZON_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000
+
+
+def year_bound(year: int) -> str:
+    return f"'{year}-01-01 00:00:00 {STATS_TIMEZONE}'"
+
+
+def ensure_partitions(years: Iterable[int]):
+    # Create the missing partitions of the given years. Rows of such a year
+    # already in the default partition are moved into the new one, so this
+    # also repairs a year that was not created in time.
+    for model in PARTITIONED:
+        table = model.__table__
+        columns = ", ".join(column.name for column in table.c if column.computed is None)
+        for level, archived in LEVELS.items():
+            parent = f"{table.fullname}_{level}"
+            default = f"{parent}_default"
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {parent} PARTITION OF {table.fullname} "
+                f"FOR VALUES IN ({str(archived).lower()}) PARTITION BY RANGE (trade_time)"
+            ))
+            db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {parent} DEFAULT"))
+            for year in sorted(set(years)):
+                partition = f"{parent}_{year}"
+                if db.session.execute(text("SELECT to_regclass(:name)"), {"name": partition}).scalar():
+                    continue
+                in_year = f"trade_time >= {year_bound(year)} AND trade_time < {year_bound(year + 1)}"
+                db.session.execute(text(f"CREATE TABLE {partition} (LIKE {table.fullname} INCLUDING DEFAULTS INCLUDING GENERATED)"))
+                db.session.execute(text(f"INSERT INTO {partition} ({columns}) SELECT {columns} FROM {default} WHERE {in_year}"))
+                db.session.execute(text(f"DELETE FROM {default} WHERE {in_year}"))
+                db.session.execute(text(
+                    f"ALTER TABLE {parent} ATTACH PARTITION {partition} "
+                    f"FOR VALUES FROM ({year_bound(year)}) TO ({year_bound(year + 1)})"
+                ))
+
+
+def archive_bills(horizon: datetime, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False) -> int:
+    # Move deleted bills, and bills traded before `horizon` with every share
+    # paid, with their amounts into the archive partitions; updating the
+    # partition key moves the rows. Runs in batches, committing each one
+    # with a change log entry, and so a version bump, for every participant
+    # of a visible bill. Returns the number of bills (to be) archived.
+    candidates = (
+        f"SELECT b.id, b.trade_time FROM {Bill.__table__.fullname} b "
+        "WHERE NOT b.archived AND (b.deleted OR (b.trade_time < :horizon AND NOT EXISTS ("
+        f"SELECT 1 FROM {BillAmount.__table__.fullname} a "
+        "WHERE a.bill_id = b.id AND a.trade_time = b.trade_time AND NOT a.archived AND NOT a.completed"
+        ")))"
+    )
+    if dry_run:
+        return db.session.execute(text(f"SELECT count(*) FROM ({candidates}) c"), {"horizon": horizon}).scalar()
+
+    total = 0
+    while True:
+        archived = db.session.execute(text(
+            f"WITH candidate AS ({candidates} ORDER BY b.id LIMIT :batch_size FOR UPDATE), "
+            f"bills AS (UPDATE {Bill.__table__.fullname} b SET archived = true FROM candidate c "
+            "WHERE b.id = c.id AND b.trade_time = c.trade_time AND NOT b.archived RETURNING b.id, b.deleted), "
+            f"amounts AS (UPDATE {BillAmount.__table__.fullname} a SET archived = true FROM candidate c "
+            "WHERE a.bill_id = c.id AND a.trade_time = c.trade_time AND NOT a.archived RETURNING a.bill_id, a.uid) "
+            "SELECT b.id, b.deleted, array_remove(array_agg(a.uid), NULL) AS uids "
+            "FROM bills b LEFT JOIN amounts a ON a.bill_id = b.id GROUP BY b.id, b.deleted"
+        ), {"horizon": horizon, "batch_size": batch_size}).all()
+        # deleted bills are already gone from every view
+        log_changes(ChangeOp.archive, [(bid, uids) for bid, deleted, uids in archived if not deleted])
+        db.session.commit()
+        total += len(archived)
+        if len(archived) < batch_size:
+            return total
+
+
+def maintain(horizon_days=ARCHIVE_HORIZON_DAYS, dry_run=False) -> int:
+    # partitions for this year and the next, then the archival
+    now = datetime.now(ZoneInfo(STATS_TIMEZONE))
+    if not dry_run:
+        ensure_partitions([now.year, now.year + 1])
+        db.session.commit()
+    return archive_bills(now - timedelta(days=horizon_days), dry_run=dry_run)
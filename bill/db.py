@@ -1,3 +1,4 @@
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
 from enum import StrEnum
 
 
@@ -9,22 +10,56 @@ class BaseBill(Base):
     __table_args__ = {'schema': 'bill'}
 
 
+# text searched by /bill/search; the trigram index must use this exact expression
+SEARCH_DOCUMENT = "coalesce(title, '') || ' ' || coalesce(description, '')"
+
+
 class Bill(BaseBill):
-    trade_time = db.Column(db.DateTime(timezone=True))
+    __table_args__ = (
+        db.Index('ix_bill_bill_party_id', 'party_id'),
+        db.Index('ix_bill_bill_counterparty_id', 'counterparty_id'),
+        # newest-first listing and keyset pagination of live bills
+        db.Index(
+            'ix_bill_bill_live_trade_time',
+            db.text('trade_time DESC'), db.text('id DESC'),
+            postgresql_where=db.text('NOT deleted')
+        ),
+        # words, and substrings the word split misses (e.g. runs of CJK)
+        db.Index('ix_bill_bill_search', 'search', postgresql_using='gin'),
+        db.Index(
+            'ix_bill_bill_search_trgm',
+            db.text(f"({SEARCH_DOCUMENT}) gin_trgm_ops"),
+            postgresql_using='gin'
+        ),
+        # hot and archived bills, each by year of trade_time, see bill.archive
+        BaseBill.__table_args__ | {'postgresql_partition_by': 'LIST (archived)'}
+    )
+    # a unique key of a partitioned table must include the partition key
+    trade_time = db.Column(db.DateTime(timezone=True), primary_key=True)
     title = db.Column(db.Text)
     description = db.Column(db.Text)
     price = db.Column(db.Numeric(precision=10, scale=2))
     party_id = db.Column(db.Integer)
     counterparty_id = db.Column(db.Integer)
     deleted = db.Column(db.Boolean, default=False)
+    archived = db.Column(db.Boolean, primary_key=True, default=False)
+    search = db.deferred(db.Column(TSVECTOR, db.Computed(f"to_tsvector('simple', {SEARCH_DOCUMENT})", persisted=True)))
 
 
 class BillAmount(BaseBill):
+    # partitioned like its bill, whose trade_time and archived it copies
+    __table_args__ = (
+        db.UniqueConstraint('bill_id', 'uid', 'trade_time', 'archived', name='uq_bill_bill_amount_bill_id_uid'),
+        db.Index('ix_bill_bill_amount_uid', 'uid', 'bill_id'),
+        BaseBill.__table_args__ | {'postgresql_partition_by': 'LIST (archived)'}
+    )
     bill_id = db.Column(db.Integer)
     uid = db.Column(db.String(32))
     price = db.Column(db.Numeric(precision=10, scale=2))
     diff = db.Column(db.Numeric(precision=10, scale=2))
     completed = db.Column(db.Boolean)
+    trade_time = db.Column(db.DateTime(timezone=True), primary_key=True)
+    archived = db.Column(db.Boolean, primary_key=True, default=False)
 
 
 class ApportionMethod(StrEnum):
@@ -34,23 +69,42 @@ class ApportionMethod(StrEnum):
 
 
 class Apportion(BaseBill):
+    __table_args__ = (
+        db.UniqueConstraint('bill_id', name='uq_bill_apportion_bill_id'),
+        BaseBill.__table_args__
+    )
     bill_id = db.Column(db.Integer)
     method = db.Column(db.Enum(ApportionMethod))
 
 
 class ApportionDetail(BaseBill):
+    __table_args__ = (
+        db.Index('ix_bill_apportion_detail_apportion_id', 'apportion_id'),
+        BaseBill.__table_args__
+    )
     apportion_id = db.Column(db.Integer)
     uid = db.Column(db.String(32))
     value = db.Column(db.Numeric(precision=10, scale=2))
 
 
 class ApportionPreset(BaseBill):
+    __table_args__ = (
+        db.Index('ix_bill_apportion_preset_oid', 'oid'),
+        BaseBill.__table_args__
+    )
     name = db.Column(db.Text)
     oid = db.Column(db.String(32))
     method = db.Column(db.Enum(ApportionMethod))
+    # copy of the apportion_preset_detail rows as [{"uid", "value"}], so a
+    # list of presets loads without touching the detail table
+    details = db.Column(JSONB)
 
 
 class ApportionPresetDetail(BaseBill):
+    __table_args__ = (
+        db.UniqueConstraint('apportion_preset_id', 'uid', name='uq_bill_apportion_preset_detail_preset_id_uid'),
+        BaseBill.__table_args__
+    )
     apportion_preset_id = db.Column(db.Integer)
     uid = db.Column(db.String(32))
     value = db.Column(db.Numeric(precision=10, scale=2))
@@ -61,5 +115,62 @@ class Party(BaseBill):
 
 
 class PartyUser(BaseBill):
+    __table_args__ = (
+        db.UniqueConstraint('party_id', 'uid', name='uq_bill_party_user_party_id_uid'),
+        db.Index('ix_bill_party_user_uid', 'uid', 'party_id'),
+        BaseBill.__table_args__
+    )
     party_id = db.Column(db.Integer)
     uid = db.Column(db.String(32))
+
+
+class Balance(BaseBill):
+    # Outstanding amount `uid` owes `counterpart_uid`, kept for both directions
+    # (the mirrored row holds the negated amount)
+    __table_args__ = (
+        db.UniqueConstraint('uid', 'counterpart_uid'),
+        BaseBill.__table_args__
+    )
+    uid = db.Column(db.String(32), nullable=False)
+    counterpart_uid = db.Column(db.String(32), nullable=False)
+    amount = db.Column(db.Numeric(precision=12, scale=2), nullable=False, default=0)
+
+
+class MonthlyRollup(BaseBill):
+    # Per calendar month and pair of users, over non-deleted bills: `uid`'s
+    # share of the bills `counterpart_uid` paid (its own bills when both are
+    # the same) and `counterpart_uid`'s share of the bills `uid` paid
+    __table_args__ = (
+        db.UniqueConstraint('uid', 'month', 'counterpart_uid', name='uq_bill_monthly_rollup_uid_month_counterpart_uid'),
+        BaseBill.__table_args__
+    )
+    uid = db.Column(db.String(32), nullable=False)
+    month = db.Column(db.Date, nullable=False)
+    counterpart_uid = db.Column(db.String(32), nullable=False)
+    spent = db.Column(db.Numeric(precision=12, scale=2), nullable=False, default=0)
+    received = db.Column(db.Numeric(precision=12, scale=2), nullable=False, default=0)
+    bills = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeOp(StrEnum):
+    create = "create"
+    complete = "complete"
+    delete = "delete"
+    # moved to the archive partitions by bill.archive
+    archive = "archive"
+
+
+class ChangeLog(BaseBill):
+    # Outbox of bill mutations, appended by the transaction making them and
+    # read by /bill/changes. `xid` is that transaction, `id` orders the
+    # entries of one transaction; `uids` are the users whose view changed.
+    __table_args__ = (
+        db.Index('ix_bill_change_log_uids', 'uids', postgresql_using='gin'),
+        db.Index('ix_bill_change_log_xid_id', 'xid', 'id'),
+        BaseBill.__table_args__
+    )
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    xid = db.Column(db.BigInteger, nullable=False, server_default=db.text("pg_current_xact_id()::text::bigint"))
+    bill_id = db.Column(db.Integer, nullable=False)
+    uids = db.Column(ARRAY(db.Text), nullable=False)
+    op = db.Column(db.Enum(ChangeOp), nullable=False)
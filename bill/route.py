@@ -1,116 +1,325 @@
-from flask import Blueprint, g, make_response, request, jsonify, abort
+from flask import Blueprint, Response, g, make_response, request, jsonify, abort, stream_with_context
+from datetime import datetime
 from decimal import Decimal
-from typing import Dict, List
-from random import choice
-from sqlalchemy import select
+from sqlalchemy import select, exists
+from sqlalchemy.exc import OperationalError
+from pydantic import ValidationError
+from functools import wraps
+
+
+import json
+import csv
+import io
 
 
 from common.auth import require_auth, with_logto_token
+from common.version import get_versions, etag, is_fresh, not_modified, with_etag
 from common.util import (
-    get_user_by_id,
+    get_users_by_ids,
     get_organizations_by_uid,
-    get_organizations_member_by_id
+    get_organizations_member_by_id,
+    get_organizations_members,
+    read_directory_versions
 )
 from bill.db import (
     db,
     Bill, BillAmount,
-    ApportionMethod, Apportion, ApportionDetail, ApportionPreset, ApportionPresetDetail,
-    Party, PartyUser
+    ChangeOp
+)
+from bill.util import (
+    get_bill_rows_by_uid, iter_bill_rows_by_uid, search_bill_rows, encode_cursor, decode_cursor,
+    get_changes, encode_change_cursor, decode_change_cursor, log_changes,
+    update_balance, outstanding_debts, complete_amounts, get_balance_by_uid, get_net_positions,
+    remove_from_rollup, get_monthly_stats, compute_owed, insert_bills, get_presets, invalidate_presets
 )
-from bill.util import get_bill_by_uid
+from bill.settle import settle
 from bill.validate import ValidatedBill
 
 
 bill = Blueprint('bill', __name__, url_prefix="/bill")
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BATCH_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+MAX_SEARCH_LENGTH = 100
+EXPORT_COLUMNS = ["id", "time", "title", "description", "total", "payer", "price", "diff", "completed"]
+# a CSV cell starting with one of these is run as a formula by spreadsheets
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+# runs of a write whose rows bill.archive moved to another partition meanwhile
+MOVED_ROW_ATTEMPTS = 3
+SERIALIZATION_FAILURE = "40001"
+
+
+def retry_moved_rows(f):
+    # Archiving moves the rows of a bill to the archive partitions. A write
+    # that waited on such a row fails with a serialization error; run again,
+    # it finds the bill archived.
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        for attempt in range(MOVED_ROW_ATTEMPTS):
+            try:
+                return f(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if getattr(e.orig, "pgcode", None) != SERIALIZATION_FAILURE or attempt == MOVED_ROW_ATTEMPTS - 1:
+                    raise
+    return decorated
+
+
+def csv_cell(value):
+    # user text is exported as text; numbers keep their sign
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def bill_item(row, users):
+    # a bill_rows_query row as listed to the caller
+    return {
+        "id": row.Bill.id,
+        "title": row.Bill.title,
+        "time": row.Bill.trade_time.isoformat(),
+        "description": row.Bill.description,
+        "total": row.Bill.price,
+        "payer": (users.get(row.payer) or {}).get("username"),
+        "amount": {
+            "price": row.BillAmount.price,
+            "diff": row.BillAmount.diff
+        },
+        "is_completed": row.BillAmount.completed
+    }
+
+
+def bill_filters(uid, args):
+    # filters of /bill/list and /bill/export from the query string
+    status = args.get("status")
+    role = args.get("role")
+    archived = args.get("archived", "include")
+    if status not in (None, "completed", "outstanding") or role not in (None, "payer", "payee"):
+        abort(400)
+    if archived not in ("exclude", "include"):
+        abort(400)
+    try:
+        filters = {
+            "completed": None if status is None else status == "completed",
+            "role": role,
+            "include_archived": archived == "include",
+            "start": datetime.fromisoformat(args["start"]) if "start" in args else None,
+            "end": datetime.fromisoformat(args["end"]) if "end" in args else None
+        }
+    except ValueError:
+        abort(400)
+
+    oid = args.get("organization_id")
+    if oid is not None:
+        members = get_organizations_member_by_id(oid)
+        if members is None or uid not in [u["id"] for u in members]:
+            abort(403)
+        filters["members"] = [u["id"] for u in members]
+    return filters
+
 
 @bill.route("/list", methods=['GET'])
 @require_auth
 @with_logto_token
 def bill_list():
     uid = g.current_user["sub"]
-    bill_list = get_bill_by_uid(uid)
-    if len(bill_list) == 0:
+    args = request.args
+    # The bills are covered by the caller's version, read before them. The
+    # payers' names and the members of `organization_id` are covered by the
+    # directory versions the lookups read, so the tag is built last.
+    versions = get_versions(("user", uid))
+    filters = bill_filters(uid, args)
+    # Pages only when asked to with `limit` or `cursor`; clients unaware of
+    # X-Next-Cursor keep getting the whole list.
+    paged = "limit" in args or "cursor" in args
+    try:
+        limit = min(int(args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE) if paged else None
+        filters["after"] = decode_cursor(args["cursor"]) if "cursor" in args else None
+    except ValueError:
+        abort(400)
+    if paged and limit <= 0:
+        abort(400)
+
+    rows = get_bill_rows_by_uid(uid, limit=limit + 1 if paged else None, **filters)
+    page = rows[:limit] if paged else rows
+    users = get_users_by_ids(row.payer for row in page)
+    tag = etag("bill.list", uid, versions, read_directory_versions(), sorted(args.items(multi=True)))
+    if is_fresh(tag):
+        return not_modified(tag)
+    if len(rows) == 0:
+        return with_etag(('', 204), tag)
+
+    response = with_etag(jsonify([bill_item(row, users) for row in page]), tag)
+    if paged and len(rows) > limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[limit - 1].Bill)
+    return response
+
+
+@bill.route("/search", methods=['GET'])
+@require_auth
+@with_logto_token
+def search_bills():
+    # The caller's bills whose title or description match `q`, best match
+    # first, with the filters of /bill/list and offset pagination
+    uid = g.current_user["sub"]
+    args = request.args
+    q = args.get("q", "").strip()
+    if len(q) == 0 or len(q) > MAX_SEARCH_LENGTH:
+        abort(400)
+    filters = bill_filters(uid, args)
+    try:
+        limit = min(int(args.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        offset = int(args.get("offset", 0))
+    except ValueError:
+        abort(400)
+    if limit <= 0 or offset < 0:
+        abort(400)
+
+    rows = search_bill_rows(uid, q, limit + 1, offset, **filters)
+    if len(rows) == 0:
         return make_response('', 204)
-    
-    result = []
-    for bid in [b.id for b in bill_list]:
-        stmt = select(Bill).where(Bill.id == bid)
-        bill = db.session.execute(stmt).scalar_one()
-        if bill.deleted is True:
-            continue
-        
-        amount_stmt = select(BillAmount).where(
-            BillAmount.uid == uid,
-            BillAmount.bill_id == bid
-        )
-        amount = db.session.execute(amount_stmt).scalar_one()
-        
-        payer_stmt = select(PartyUser).where(PartyUser.party_id == bill.party_id)
-        payer_party_user = db.session.execute(payer_stmt).scalar_one_or_none()
-        
-        result.append({
-            "id": bid,
-            "title": bill.title,
-            "time": bill.trade_time.isoformat(),
-            "description": bill.description,
-            "total": bill.price,
-            "payer": get_user_by_id(payer_party_user.uid)["username"],
-            "amount": {
-                "price": amount.price,
-                "diff": amount.diff
-            },
-            "is_completed": amount.completed
-        })
 
-    return jsonify(result)
+    users = get_users_by_ids(row.payer for row in rows[:limit])
+    response = jsonify([bill_item(row, users) for row in rows[:limit]])
+    if len(rows) > limit:
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return response
+
+
+@bill.route("/changes", methods=['GET'])
+@require_auth
+@with_logto_token
+def bill_changes():
+    # Bills created, paid or deleted for the caller after `since`, the cursor
+    # of an earlier response, as in /bill/list plus the ids of deleted ones.
+    # Without `since` only the current cursor is returned: take it before
+    # the initial /bill/list so no change in between is missed.
+    uid = g.current_user["sub"]
+    args = request.args
+    try:
+        limit = min(int(args.get("limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        after = decode_change_cursor(args["since"]) if "since" in args else None
+    except ValueError:
+        abort(400)
+    if limit <= 0:
+        abort(400)
+
+    bill_ids, cursor, more = get_changes(uid, after, limit)
+    bill_ids = list(dict.fromkeys(bill_ids))
+    # archived bills still exist; only the missing ones were deleted
+    rows = get_bill_rows_by_uid(uid, bill_ids=bill_ids) if bill_ids else []
+    live = {row.Bill.id for row in rows}
+    users = get_users_by_ids(row.payer for row in rows)
+    return jsonify({
+        "cursor": encode_change_cursor(*cursor),
+        "has_more": more,
+        "bills": [bill_item(row, users) for row in rows],
+        "deleted": [bid for bid in bill_ids if bid not in live]
+    })
+
+
+@bill.route("/export", methods=['GET'])
+@require_auth
+@with_logto_token
+def export_bills():
+    # The caller's bills, with the filters of /bill/list, streamed as CSV or
+    # NDJSON one cursor batch at a time, so memory does not grow with history
+    uid = g.current_user["sub"]
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        abort(400)
+    filters = bill_filters(uid, request.args)
+
+    def records():
+        for rows in iter_bill_rows_by_uid(uid, EXPORT_BATCH_SIZE, **filters):
+            users = get_users_by_ids(row.payer for row in rows)
+            yield [{
+                "id": row.Bill.id,
+                "time": row.Bill.trade_time.isoformat(),
+                "title": row.Bill.title,
+                "description": row.Bill.description,
+                "total": row.Bill.price,
+                "payer": (users.get(row.payer) or {}).get("username"),
+                "price": row.BillAmount.price,
+                "diff": row.BillAmount.diff,
+                "completed": row.BillAmount.completed
+            } for row in rows]
+
+    def generate():
+        if fmt == "ndjson":
+            for batch in records():
+                yield "".join(json.dumps(record, default=str, ensure_ascii=False) + "\n" for record in batch)
+            return
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_COLUMNS)
+        writer.writeheader()
+        for batch in records():
+            writer.writerows({key: csv_cell(value) for key, value in record.items()} for record in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename=bills.{fmt}"}
+    )
 
 
 @bill.route("/complete_amount", methods=['POST'])
 @require_auth
+@retry_moved_rows
 def complete_amount():
     uid = g.current_user["sub"]
-    bid = request.get_json().get("bill_id")
-    if bid is None:
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    bid = data.get("bill_id")
+    if not isinstance(bid, int):
         abort(400)
     
-    stmt = select(BillAmount).where(
-        BillAmount.uid == uid,
-        BillAmount.bill_id == bid
-    )
-    amount = db.session.execute(stmt).scalar_one()
-    amount.completed = True
+    if not complete_amounts(uid, bill_ids=[bid]):
+        # nothing changed: already paid, or not a participant of the bill
+        stmt = select(exists().where(BillAmount.uid == uid, BillAmount.bill_id == bid))
+        if not db.session.execute(stmt).scalar():
+            abort(404)
     db.session.commit()
-    db.session.flush()
-    
-    stmt = select(Bill).where(Bill.id == bid)
-    bill = db.session.execute(stmt).scalar_one()
-    
-    stmt = select(PartyUser).where(PartyUser.party_id == bill.party_id)
-    payer = db.session.execute(stmt).scalar_one()
-    
-    stmt = select(BillAmount).where(BillAmount.bill_id == bid)
-    all_amounts = db.session.execute(stmt).scalars().all()
-    
-    # Check if all other users (excpet payer) have completed their parts
-    if all(
-        bill_amount.completed 
-        for bill_amount in all_amounts 
-        if bill_amount.uid != payer.uid
-    ):
-        stmt = select(BillAmount).where(
-            BillAmount.bill_id == bid,
-            BillAmount.uid == payer.uid
-        )
-        payer_amount: BillAmount = db.session.execute(stmt).scalar_one()
-        payer_amount.completed = True
-        db.session.commit()
-    
     return make_response('', 200)
 
 
+@bill.route("/complete_amounts", methods=['POST'])
+@require_auth
+@retry_moved_rows
+def batch_complete_amount():
+    # Pay several bills at once: the given bill_ids, everything owed to one
+    # payer, or both filters combined
+    uid = g.current_user["sub"]
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    bill_ids = data.get("bill_ids")
+    payer = data.get("payer")
+    if bill_ids is None and payer is None:
+        abort(400)
+    if bill_ids is not None:
+        if not isinstance(bill_ids, list) or not all(isinstance(bid, int) for bid in bill_ids):
+            abort(400)
+        if len(bill_ids) > MAX_BATCH_SIZE:
+            abort(413)
+    if payer is not None and not isinstance(payer, str):
+        abort(400)
+
+    completed = complete_amounts(uid, bill_ids=bill_ids, payer_uid=payer)
+    db.session.commit()
+    return jsonify({"completed": completed})
+
+
 @bill.route("/delete_amount", methods=['POST'])
 @require_auth
+@retry_moved_rows
 def delete_bill():
     uid = g.current_user["sub"]
     data = request.get_json()
@@ -119,53 +328,188 @@ def delete_bill():
         abort(400)
     
     stmt = select(Bill).where(Bill.id == bid)
-    bill = db.session.execute(stmt).scalar_one()
+    bill = db.session.execute(stmt.with_for_update()).scalar_one()
+    if not bill.deleted:
+        update_balance(
+            (debtor, creditor, -amount)
+            for debtor, creditor, amount in outstanding_debts([bid])
+        )
+        remove_from_rollup([bid])
+        participants = select(BillAmount.uid).where(BillAmount.bill_id == bid)
+        log_changes(ChangeOp.delete, [(bid, db.session.execute(participants).scalars())])
     bill.deleted = True
     db.session.commit()
     return make_response('', 200)
 
 
+@bill.route("/balance", methods=['GET'])
+@require_auth
+@with_logto_token
+def query_balance():
+    uid = g.current_user["sub"]
+    rows = get_balance_by_uid(uid)
+    if len(rows) == 0:
+        return make_response('', 204)
+
+    users = get_users_by_ids(counterpart_uid for counterpart_uid, _ in rows)
+    return jsonify([{
+        "uid": counterpart_uid,
+        "username": (users.get(counterpart_uid) or {}).get("username"),
+        "amount": amount
+    } for counterpart_uid, amount in rows])
+
+
+@bill.route("/stats", methods=['GET'])
+@require_auth
+@with_logto_token
+def query_stats():
+    # Monthly spent / owed / received of the caller, broken down by
+    # counterpart, or of every member of an organization counting only the
+    # bills shared inside it. `start` and `end` are YYYY-MM, end exclusive.
+    uid = g.current_user["sub"]
+    args = request.args
+    try:
+        start = datetime.strptime(args["start"], "%Y-%m").date() if "start" in args else None
+        end = datetime.strptime(args["end"], "%Y-%m").date() if "end" in args else None
+    except ValueError:
+        abort(400)
+
+    oid = args.get("organization_id")
+    if oid is None:
+        rows = get_monthly_stats([uid], start=start, end=end)
+        users = get_users_by_ids(row.counterpart_uid for row in rows if row.counterpart_uid != uid)
+        group = "counterparts"
+    else:
+        members = get_organizations_member_by_id(oid)
+        if members is None or uid not in [u["id"] for u in members]:
+            abort(403)
+        member_ids = [u["id"] for u in members]
+        rows = get_monthly_stats(member_ids, counterparts=member_ids, start=start, end=end)
+        users = {u["id"]: u for u in members}
+        group = "members"
+    if len(rows) == 0:
+        return make_response('', 204)
+
+    def zero():
+        return {"spent": Decimal('0'), "owed": Decimal('0'), "received": Decimal('0'), "bills": 0}
+
+    months = {}
+    for row in rows:
+        month = months.setdefault(row.month, {"total": zero(), group: {}})
+        key = row.counterpart_uid if oid is None else row.uid
+        # owed: the shares of bills somebody else paid
+        owed = row.spent if row.counterpart_uid != row.uid else Decimal('0')
+        for stat in (month["total"], month[group].setdefault(key, zero())):
+            stat["spent"] += row.spent
+            stat["owed"] += owed
+            stat["received"] += row.received
+            stat["bills"] += row.bills
+
+    result = []
+    for month, stats in months.items():
+        if oid is None:
+            # the caller's own bills are in the totals only
+            stats[group].pop(uid, None)
+        else:
+            # a bill shared by several members would be counted once per member
+            del stats["total"]["bills"]
+        result.append({"month": month.strftime("%Y-%m")} | stats.pop("total") | {group: [
+            {"uid": key, "username": (users.get(key) or {}).get("username")} | stat
+            for key, stat in stats[group].items()
+        ]})
+    return jsonify(result)
+
+
+@bill.route("/settle_plan", methods=['GET'])
+@require_auth
+@with_logto_token
+def settle_plan():
+    uid = g.current_user["sub"]
+    oid = request.args.get("organization_id")
+    if oid is None:
+        abort(400)
+    members = get_organizations_member_by_id(oid)
+    if members is None or uid not in [u["id"] for u in members]:
+        abort(403)
+
+    transfers = settle(get_net_positions(u["id"] for u in members))
+    if len(transfers) == 0:
+        return make_response('', 204)
+
+    users = {u["id"]: u for u in members}
+    return jsonify([{
+        "from": debtor,
+        "from_username": users[debtor].get("username"),
+        "to": creditor,
+        "to_username": users[creditor].get("username"),
+        "amount": amount
+    } for debtor, creditor, amount in transfers])
+
+
 @bill.route("/apportion_preset", methods=['GET'])
 @require_auth
 @with_logto_token
 def query_apportion_preset():
     uid = g.current_user["sub"]
+    # Presets saved in the caller's organizations bump the caller's version;
+    # organizations, members and names are covered by the directory versions
+    # the lookups read, so the tag is built last.
+    versions = get_versions(("user", uid))
+    result = list_presets(uid)
+    tag = etag("bill.apportion_preset", uid, versions, read_directory_versions())
+    if is_fresh(tag):
+        return not_modified(tag)
+    if len(result) == 0:
+        return with_etag(('', 204), tag)
+    return with_etag(jsonify(result), tag)
+
+
+def list_presets(uid):
+    # the presets of the caller's organizations, with usernames
     org = get_organizations_by_uid(uid)
     if org is None:
-        return make_response('', 204)
+        return []
     
     org_map = {o["id"]: o for o in org}
-    org_members = {
-        oid: get_organizations_member_by_id(oid)
-        for oid in org_map
-    }
-    
-    stmt = select(ApportionPreset).where(ApportionPreset.oid.in_(org_map))
-    presets: List[ApportionPreset] = db.session.execute(stmt).scalars().all()
-    if len(presets) == 0:
-        return make_response('', 204)
-    
-    result = []
-    for preset in presets:
-        stmt = select(ApportionPresetDetail).where(
-            ApportionPresetDetail.apportion_preset_id == preset.id,
-            ApportionPresetDetail.uid.in_([u["id"] for u in org_members.get(preset.oid)])
-        )
-        details_result = db.session.execute(stmt)
-        details: List[ApportionPresetDetail] = details_result.scalars().all()
-
-        result.append({
-            "name": preset.name,
-            "org": org_map[preset.oid]["name"],
-            "method": preset.method.value,
-            "details": [{
-                "uid": detail.uid,
-                "username": get_user_by_id(detail.uid)["username"],
-                "value": detail.value
-            } for detail in details]
-        })
+    presets = get_presets(org_map)
+    if not any(presets.values()):
+        return []
 
-    return jsonify(result)
+    # details of users who left the organization are hidden
+    org_members = get_organizations_members(org_map)
+    result = []
+    for oid, items in presets.items():
+        members = {u["id"] for u in org_members[oid] or []}
+        for preset in items:
+            result.append({
+                "name": preset["name"],
+                "org": org_map[oid]["name"],
+                "method": preset["method"],
+                "details": [{
+                    "uid": detail["uid"],
+                    "value": detail["value"]
+                } for detail in preset["details"] if detail["uid"] in members]
+            })
+
+    users = get_users_by_ids(d["uid"] for item in result for d in item["details"])
+    for item in result:
+        for detail in item["details"]:
+            detail["username"] = (users.get(detail["uid"]) or {}).get("username")
+    return result
+
+
+def preset_organizations(bills):
+    return {data.apportion_preset_organization_id for data, _ in bills if data.as_apportion_preset}
+
+
+def preset_audience(oids):
+    # A saved preset changes /bill/apportion_preset for every member of its
+    # organization, not only for the participants of the bill
+    return [("preset", oid) for oid in oids] + [
+        ("user", user["id"])
+        for members in get_organizations_members(oids).values() if members
+        for user in members
+    ]
 
 
 @bill.route("/create", methods=['POST'])
@@ -174,118 +518,13 @@ def query_apportion_preset():
 def create_bill():
     try:
         data = ValidatedBill(**request.get_json())
-
-        party = Party()
-        db.session.add(party)
-        db.session.flush()
-        puser = PartyUser()
-        puser.party_id = party.id
-        puser.uid = data.party
-        db.session.add(puser)
-
-        counterparty = Party()
-        db.session.add(counterparty)
-        db.session.flush()
-        for uid in data.counterparty:
-            puser = PartyUser()
-            puser.party_id = counterparty.id
-            puser.uid = uid
-            db.session.add(puser)
-
-        new_bill = Bill()
-        new_bill.trade_time = data.trade_time
-        new_bill.title = data.title
-        new_bill.description = data.description
-        new_bill.price = data.price
-        new_bill.party_id = party.id
-        new_bill.counterparty_id = counterparty.id
-        db.session.add(new_bill)
-        db.session.flush()
-
-        # apportion
-        payer_uid = data.party
-        counterparty_uids = data.counterparty
-        apportions_map = {ap.user: ap.value for ap in data.apportions}
-        total_price = data.price
-        method = data.apportion_method
-
-
-        apportion = Apportion()
-        apportion.bill_id=new_bill.id
-        apportion.method=method
-        db.session.add(apportion)
-        db.session.flush()
-
-        for uid in counterparty_uids:
-            apportion_detail = ApportionDetail()
-            apportion_detail.apportion_id=apportion.id
-            apportion_detail.uid=uid
-            apportion_detail.value=apportions_map.get(uid)
-            db.session.add(apportion_detail)
-        
-        # apportion preset
-        if data.as_apportion_preset:
-            preset = ApportionPreset()
-            preset.name = data.apportion_preset_title
-            preset.oid = data.apportion_preset_organization_id
-            preset.method = method
-            db.session.add(preset)
-            db.session.flush()
-
-            for uid in counterparty_uids:
-                preset_detail = ApportionPresetDetail()
-                preset_detail.apportion_preset_id = preset.id
-                preset_detail.uid = uid
-                preset_detail.value = apportions_map.get(uid)
-                db.session.add(preset_detail)
-
-        # bill amount
-        amounts: Dict[str, BillAmount] = {}
-        for uid in counterparty_uids:
-            amounts[uid] = BillAmount()
-            amounts[uid].bill_id=new_bill.id
-            amounts[uid].uid=uid
-            amounts[uid].price=Decimal('0')
-            amounts[uid].diff=Decimal('0')
-            amounts[uid].completed=False
-        amounts[payer_uid] = BillAmount()
-        amounts[payer_uid].bill_id=new_bill.id
-        amounts[payer_uid].uid=payer_uid
-        amounts[payer_uid].price=data.price
-        amounts[payer_uid].diff=-data.price
-        amounts[payer_uid].completed=False
-
-        # calculate diff
-        if method == ApportionMethod.price:
-            owed = {uid: apportions_map.get(uid, Decimal('0')) for uid in counterparty_uids}
-        elif method == ApportionMethod.ratio:
-            owed = {
-                uid: (total_price * apportions_map[uid] / Decimal('100')).quantize(Decimal('0.01'))
-                for uid in counterparty_uids
-            }
-        elif method == ApportionMethod.share:
-            total_share = sum(apportions_map[uid] for uid in counterparty_uids)
-            owed = {
-                uid: (total_price * apportions_map[uid] / total_share).quantize(Decimal('0.01'))
-                for uid in counterparty_uids
-            }
-        else:
-            abort(400)
-
-        # handle round-off error
-        diff = total_price - sum(owed.values(), Decimal('0'))
-        if diff != Decimal('0'):
-            owed[choice(counterparty_uids)] += diff
-
-        # update diff
-        for uid in counterparty_uids:
-            amounts[uid].diff += owed[uid]
-
-        # insert amount
-        for uid in amounts:
-            db.session.add(amounts[uid])
+        bills = [(data, compute_owed(data))]
+        oids = preset_organizations(bills)
+        # ids are reserved up front so every row goes out in one statement
+        insert_bills(bills, versions=preset_audience(oids))
 
         db.session.commit()
+        invalidate_presets(oids)
         return make_response('', 201)
 
     except (ValueError, TypeError) as e:
@@ -296,3 +535,63 @@ def create_bill():
         print(e)
         db.session.rollback()
         abort(500)
+
+
+@bill.route("/batch_create", methods=['POST'])
+@require_auth
+@with_logto_token
+def batch_create_bill():
+    # Accepts a JSON array of bills or NDJSON (one bill per line)
+    try:
+        if request.mimetype == "application/x-ndjson":
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        else:
+            items = request.get_json()
+    except ValueError:
+        abort(400)
+    if not isinstance(items, list) or len(items) == 0:
+        abort(400)
+    if len(items) > MAX_BATCH_SIZE:
+        abort(413)
+
+    uids = set()
+    for item in items:
+        if isinstance(item, dict):
+            uids.add(item.get("party"))
+            if isinstance(item.get("counterparty"), list):
+                uids.update(item["counterparty"])
+    users = get_users_by_ids(uid for uid in uids if isinstance(uid, str) and 1 <= len(uid) <= 32)
+
+    bills = []
+    indexes = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            data = ValidatedBill.model_validate(item, context={"users": users})
+            bills.append((data, compute_owed(data)))
+            indexes.append(index)
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "error": e.errors(include_url=False, include_context=False, include_input=False)
+            })
+        except (ValueError, TypeError, KeyError, ArithmeticError) as e:
+            errors.append({"index": index, "error": str(e)})
+
+    if len(bills) == 0:
+        return make_response(jsonify({"created": [], "errors": errors}), 400)
+
+    try:
+        oids = preset_organizations(bills)
+        bill_ids = insert_bills(bills, versions=preset_audience(oids))
+        db.session.commit()
+        invalidate_presets(oids)
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        abort(500)
+
+    return make_response(jsonify({
+        "created": [{"index": index, "id": bid} for index, bid in zip(indexes, bill_ids)],
+        "errors": errors
+    }), 201)
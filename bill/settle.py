@@ -0,0 +1,48 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Tuple
+
+
+import heapq
+
+
+CENT = Decimal('0.01')
+
+
+def net_positions(debts: Iterable[Tuple[str, str, Decimal]]) -> Dict[str, Decimal]:
+    # Fold (debtor, creditor, amount) debts into one net amount per user;
+    # positive means the user owes money, negative that they are owed.
+    positions: Dict[str, Decimal] = {}
+    for debtor, creditor, amount in debts:
+        positions[debtor] = positions.get(debtor, Decimal('0')) + amount
+        positions[creditor] = positions.get(creditor, Decimal('0')) - amount
+    return positions
+
+
+def settle(positions: Dict[str, Decimal]) -> List[Tuple[str, str, Decimal]]:
+    # Greedy max-debtor / max-creditor matching over two heaps. Every transfer
+    # clears at least one side, so there are at most n - 1 transfers and the
+    # whole plan costs O(n log n).
+    debtors = []
+    creditors = []
+    for uid, amount in positions.items():
+        amount = amount.quantize(CENT, rounding=ROUND_HALF_UP)
+        if amount > 0:
+            debtors.append((-amount, uid))
+        elif amount < 0:
+            creditors.append((amount, uid))
+    if sum(-a for a, _ in debtors) != sum(-a for a, _ in creditors):
+        raise ValueError("net positions do not sum to zero")
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        transfers.append((debtor, creditor, amount))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+    return transfers
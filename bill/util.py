@@ -1,8 +1,29 @@
-from sqlalchemy import select, union
-from typing import List
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, update, union, union_all, tuple_, exists, delete, func, text, literal, case, Date
+from sqlalchemy.orm import aliased
+from collections import defaultdict
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+from decimal import Decimal
+from typing import Dict, List, Iterable, Tuple
+from random import choice
 
 
-from bill.db import db, Bill, PartyUser
+import base64
+import json
+
+
+from common.db import Version
+from common.cache import TTLCache
+from common.version import version_rows, bump_versions, get_versions
+from directory.util import escape_like
+from bill.db import (
+    db,
+    Bill, BillAmount,
+    ApportionMethod, Apportion, ApportionDetail, ApportionPreset, ApportionPresetDetail,
+    Party, PartyUser, Balance, MonthlyRollup, ChangeOp, ChangeLog
+)
+from bill.validate import ValidatedBill
 
 
 def get_bill_by_uid(uid) -> List[Bill]:
@@ -16,3 +37,689 @@ def get_bill_by_uid(uid) -> List[Bill]:
     )
     query = union(payer_bill, payee_bill)
     return db.session.execute(query).all()
+
+
+def same_bill(amount, bill=Bill):
+    # Join on the whole partition key: with trade_time and archived known
+    # for each row, the planner only probes the partition holding the bill.
+    # The planner does not carry `archived IS false` across the join, so hot
+    # only queries filter both sides.
+    return (amount.bill_id == bill.id) & (amount.trade_time == bill.trade_time) & (amount.archived == bill.archived)
+
+
+def encode_cursor(bill: Bill) -> str:
+    return base64.urlsafe_b64encode(f"{bill.trade_time.isoformat()}|{bill.id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    trade_time, bid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(trade_time), int(bid)
+
+
+def bill_rows_query(
+    uid,
+    completed: bool | None = None,
+    role: str | None = None,
+    members: Iterable[str] | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    bill_ids: Iterable[int] | None = None,
+    include_archived: bool = True,
+    after: tuple | None = None,
+    limit: int | None = None
+):
+    # Each visible, non-deleted bill with the caller's amount and the payer
+    # uid, newest first. Every participant has an amount row, so joining it
+    # is what restricts the bills to the visible ones. `after` is a decoded
+    # keyset cursor on (trade_time, id); `members` keeps only bills whose
+    # participants all belong to that set.
+    # Archived bills are paid, so `completed=False` scans the hot partitions
+    # only, and start/end the partitions of those years; `include_archived`
+    # unset leaves the archive partitions out whatever the filters.
+    payer = aliased(PartyUser)
+    stmt = select(
+        Bill,
+        BillAmount,
+        payer.uid.label("payer")
+    ).join(
+        BillAmount,
+        same_bill(BillAmount) & (BillAmount.uid == uid)
+    ).outerjoin(
+        payer,
+        payer.party_id == Bill.party_id
+    ).where(
+        Bill.deleted.is_(False)
+    ).order_by(Bill.trade_time.desc(), Bill.id.desc())
+
+    if completed is not None:
+        stmt = stmt.where(BillAmount.completed.is_(completed))
+    if not include_archived or completed is False:
+        # archived bills are paid or deleted
+        stmt = stmt.where(Bill.archived.is_(False), BillAmount.archived.is_(False))
+    if role == "payer":
+        stmt = stmt.where(payer.uid == uid)
+    elif role == "payee":
+        stmt = stmt.where(payer.uid != uid)
+    if members is not None:
+        outsider = aliased(BillAmount)
+        stmt = stmt.where(~exists().where(
+            same_bill(outsider),
+            outsider.uid.not_in(list(members))
+        ))
+    if start is not None:
+        stmt = stmt.where(Bill.trade_time >= start, BillAmount.trade_time >= start)
+    if end is not None:
+        stmt = stmt.where(Bill.trade_time < end, BillAmount.trade_time < end)
+    if bill_ids is not None:
+        stmt = stmt.where(Bill.id.in_(list(bill_ids)))
+    if after is not None:
+        stmt = stmt.where(tuple_(Bill.trade_time, Bill.id) < tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def get_bill_rows_by_uid(uid, **filters):
+    return db.session.execute(bill_rows_query(uid, **filters)).all()
+
+
+def search_bill_rows_query(uid, q: str, limit: int, offset: int = 0, **filters):
+    # Bills of bill_rows_query matching q, best first. Words are matched
+    # through the `search` tsvector; what the 'simple' parser cannot split,
+    # such as CJK runs or word prefixes, still matches as a substring
+    # through the trigram index on the same document.
+    query = func.websearch_to_tsquery("simple", q)
+    pattern = f"%{escape_like(q)}%"
+    document = func.coalesce(Bill.title, "") + " " + func.coalesce(Bill.description, "")
+    rank = func.ts_rank(Bill.search, query) + case(
+        (Bill.title.ilike(pattern, escape="\\"), 0.1),
+        else_=0
+    )
+    return bill_rows_query(uid, **filters).where(
+        Bill.search.op("@@")(query) | document.ilike(pattern, escape="\\")
+    ).order_by(None).order_by(
+        rank.desc(), Bill.trade_time.desc(), Bill.id.desc()
+    ).limit(limit).offset(offset)
+
+
+def search_bill_rows(uid, q: str, limit: int, offset: int = 0, **filters):
+    return db.session.execute(search_bill_rows_query(uid, q, limit, offset, **filters)).all()
+
+
+def iter_bill_rows_by_uid(uid, batch_size=500, **filters):
+    # Batches of bill rows fetched through a server-side cursor, so the whole
+    # history is never loaded at once
+    result = db.session.execute(
+        bill_rows_query(uid, **filters).execution_options(yield_per=batch_size)
+    )
+    yield from result.partitions()
+
+
+def change_rows(op: ChangeOp, changes: Iterable[Tuple[int, Iterable[str]]]) -> List[dict]:
+    # change log rows of (bill_id, affected uids) pairs
+    return [{"bill_id": bid, "uids": sorted(set(uids)), "op": op} for bid, uids in changes]
+
+
+def log_changes(op: ChangeOp, changes: Iterable[Tuple[int, Iterable[str]]]):
+    # also moves the version of every affected user, see common.version
+    rows = change_rows(op, changes)
+    if rows:
+        db.session.execute(
+            text(insert_recordset(ChangeLog, list(rows[0]), "change_log")),
+            {"change_log": recordset(rows)}
+        )
+        bump_versions(("user", uid) for row in rows for uid in row["uids"])
+
+
+def encode_change_cursor(xid: int, seq: int) -> str:
+    return base64.urlsafe_b64encode(f"{xid}|{seq}".encode()).decode()
+
+
+def decode_change_cursor(cursor: str):
+    xid, seq = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return int(xid), int(seq)
+
+
+def changes_horizon() -> int:
+    # Every transaction below the snapshot xmin has finished, so the change
+    # log entries written by them are all visible from now on. Entries of
+    # transactions still running (even with a lower id) wait for a later call.
+    return db.session.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+
+
+def changes_query(uid, after: Tuple[int, int], horizon: int, limit: int):
+    return select(ChangeLog.xid, ChangeLog.id, ChangeLog.bill_id).where(
+        ChangeLog.uids.contains([uid]),
+        tuple_(ChangeLog.xid, ChangeLog.id) > tuple_(*after),
+        ChangeLog.xid < horizon
+    ).order_by(ChangeLog.xid, ChangeLog.id).limit(limit)
+
+
+def get_changes(uid, after: Tuple[int, int] | None, limit: int):
+    # (bill ids changed for uid after the cursor, next cursor, whether more
+    # changes are already available). Without a cursor only the current
+    # position is returned.
+    horizon = changes_horizon()
+    if after is None:
+        return [], (horizon, 0), False
+    rows = db.session.execute(changes_query(uid, after, horizon, limit)).all()
+    if len(rows) == limit:
+        return [row.bill_id for row in rows], (rows[-1].xid, rows[-1].id), True
+    return [row.bill_id for row in rows], max(after, (horizon, 0)), False
+
+
+# Tables whose rows accumulate deltas: conflict key and update. Rows are
+# written in key order so concurrent updates lock them consistently.
+ACCUMULATE = {
+    Balance: (
+        "uid, counterpart_uid",
+        "amount = balance.amount + excluded.amount"
+    ),
+    MonthlyRollup: (
+        "uid, month, counterpart_uid",
+        "spent = monthly_rollup.spent + excluded.spent, "
+        "received = monthly_rollup.received + excluded.received, "
+        "bills = monthly_rollup.bills + excluded.bills"
+    ),
+    Version: (
+        "scope, key",
+        "version = version.version + excluded.version"
+    )
+}
+
+
+def insert_recordset(model, columns: List[str], param: str) -> str:
+    # INSERT ... SELECT FROM jsonb_to_recordset(:param). The rows travel as a
+    # single jsonb parameter, so the SQL text only depends on the table and
+    # does not grow (or get recompiled) with every row.
+    table = model.__table__
+    names = ", ".join(columns)
+    types = ", ".join(
+        f"{name} {table.c[name].type.compile(dialect=db.engine.dialect)}"
+        for name in columns
+    )
+    sql = (
+        f"INSERT INTO {table.fullname} ({names}) SELECT {names} "
+        f"FROM jsonb_to_recordset(CAST(:{param} AS jsonb)) AS r({types})"
+    )
+    if model in ACCUMULATE:
+        key, update = ACCUMULATE[model]
+        sql += f" ORDER BY {key} ON CONFLICT ({key}) DO UPDATE SET {update}"
+    return sql
+
+
+def recordset(rows: List[dict]) -> str:
+    return json.dumps(rows, default=str)
+
+
+def balance_rows(debts: Iterable[Tuple[str, str, Decimal]]) -> List[dict]:
+    # Ledger rows adding (debtor, creditor, amount) debts in both directions
+    delta = defaultdict(Decimal)
+    for debtor, creditor, amount in debts:
+        if debtor == creditor or amount == 0:
+            continue
+        delta[(debtor, creditor)] += amount
+        delta[(creditor, debtor)] -= amount
+    return [
+        {"uid": uid, "counterpart_uid": counterpart_uid, "amount": amount}
+        for (uid, counterpart_uid), amount in delta.items()
+    ]
+
+
+def update_balance(debts: Iterable[Tuple[str, str, Decimal]]):
+    rows = balance_rows(debts)
+    if rows:
+        db.session.execute(
+            text(insert_recordset(Balance, list(rows[0]), "balance")),
+            {"balance": recordset(rows)}
+        )
+
+
+def outstanding_debts_query(bill_ids=None):
+    # (debtor, creditor, amount) for every unpaid share of non-deleted bills
+    payer = aliased(PartyUser)
+    stmt = select(BillAmount.uid, payer.uid, BillAmount.diff).join(
+        Bill, same_bill(BillAmount)
+    ).join(
+        payer, payer.party_id == Bill.party_id
+    ).where(
+        Bill.deleted.is_(False),
+        Bill.archived.is_(False),
+        BillAmount.archived.is_(False),
+        BillAmount.completed.is_(False),
+        BillAmount.uid != payer.uid
+    )
+    if bill_ids is not None:
+        stmt = stmt.where(Bill.id.in_(list(bill_ids)))
+    return stmt
+
+
+def outstanding_debts(bill_ids=None):
+    return db.session.execute(outstanding_debts_query(bill_ids)).tuples().all()
+
+
+def complete_amounts(uid, bill_ids=None, payer_uid=None) -> List[int]:
+    # Mark the uid's unpaid shares of the selected bills as paid, then the
+    # payer's own share of every bill nobody owes anything on any more.
+    # Returns the ids of the bills whose share changed. Archived bills are
+    # paid or deleted, so only the hot partitions are searched.
+    payer = aliased(PartyUser)
+    payer_amount = aliased(BillAmount)
+    # Locking the payer rows first (in id order) queues concurrent
+    # completions of the same bill, so the payer check below always sees
+    # the other shares as committed. The bill row is locked too, as by
+    # delete_bill, so a concurrent delete either sees this completion or
+    # is seen as deleted here; otherwise both reverse the share.
+    locked = select(
+        payer_amount.bill_id, payer_amount.trade_time, payer.uid.label("payer"), Bill.deleted
+    ).join(
+        Bill, same_bill(payer_amount)
+    ).join(
+        payer, (payer.party_id == Bill.party_id) & (payer.uid == payer_amount.uid)
+    ).where(
+        Bill.archived.is_(False),
+        payer_amount.archived.is_(False)
+    ).order_by(payer_amount.bill_id).with_for_update(of=[payer_amount, Bill])
+    if bill_ids is not None:
+        locked = locked.where(payer_amount.bill_id.in_(list(bill_ids)))
+    if payer_uid is not None:
+        locked = locked.where(payer.uid == payer_uid)
+    locked = locked.cte("locked")
+
+    rows = db.session.execute(update(BillAmount).where(
+        BillAmount.bill_id == locked.c.bill_id,
+        BillAmount.trade_time == locked.c.trade_time,
+        BillAmount.archived.is_(False),
+        BillAmount.uid == uid,
+        BillAmount.completed.is_(False)
+    ).values(completed=True).returning(
+        BillAmount.bill_id, BillAmount.trade_time, BillAmount.diff, locked.c.payer, locked.c.deleted
+    ).execution_options(synchronize_session=False)).all()
+    if not rows:
+        return []
+
+    # paid shares no longer count towards the balance with the payer
+    update_balance(
+        (uid, row.payer, -row.diff)
+        for row in rows
+        if not row.deleted
+    )
+
+    other = aliased(BillAmount)
+    payers = db.session.execute(update(BillAmount).where(
+        tuple_(BillAmount.bill_id, BillAmount.trade_time).in_([(row.bill_id, row.trade_time) for row in rows]),
+        BillAmount.archived.is_(False),
+        Bill.archived.is_(False),
+        same_bill(BillAmount),
+        BillAmount.uid == payer.uid,
+        payer.party_id == Bill.party_id,
+        BillAmount.completed.is_(False),
+        ~exists().where(
+            other.bill_id == BillAmount.bill_id,
+            other.trade_time == BillAmount.trade_time,
+            other.archived.is_(False),
+            other.uid != BillAmount.uid,
+            other.completed.is_(False)
+        )
+    ).values(completed=True).returning(
+        BillAmount.bill_id, BillAmount.uid
+    ).execution_options(synchronize_session=False)).all()
+
+    changes = {row.bill_id: [uid] for row in rows}
+    for row in payers:
+        changes[row.bill_id].append(row.uid)
+    log_changes(ChangeOp.complete, changes.items())
+    return [row.bill_id for row in rows]
+
+
+# calendar months of the statistics are those of the dormitory
+STATS_TIMEZONE = "Asia/Shanghai"
+
+
+def stats_month(trade_time: datetime) -> date:
+    return trade_time.astimezone(ZoneInfo(STATS_TIMEZONE)).date().replace(day=1)
+
+
+def rollup_entries(month: date, payer: str, shares: Dict[str, Decimal], sign=1):
+    # (uid, month, counterpart_uid, spent, received, bills) of one bill given
+    # each participant's share of its price
+    for uid, share in shares.items():
+        yield uid, month, payer, sign * share, Decimal('0'), sign
+        if uid != payer:
+            yield payer, month, uid, Decimal('0'), sign * share, 0
+
+
+def rollup_rows(entries) -> List[dict]:
+    delta = {}
+    for uid, month, counterpart_uid, spent, received, bills in entries:
+        row = delta.setdefault((uid, month, counterpart_uid), [Decimal('0'), Decimal('0'), 0])
+        row[0] += spent
+        row[1] += received
+        row[2] += bills
+    return [
+        {"uid": uid, "month": month, "counterpart_uid": counterpart_uid,
+         "spent": spent, "received": received, "bills": bills}
+        for (uid, month, counterpart_uid), (spent, received, bills) in delta.items()
+    ]
+
+
+def update_rollup(entries):
+    rows = rollup_rows(entries)
+    if rows:
+        db.session.execute(
+            text(insert_recordset(MonthlyRollup, list(rows[0]), "monthly_rollup")),
+            {"monthly_rollup": recordset(rows)}
+        )
+
+
+def rollup_query(bill_ids=None):
+    # rollup entries of non-deleted bills, read back from the bill tables
+    payer = aliased(PartyUser)
+    month = func.cast(func.date_trunc("month", func.timezone(STATS_TIMEZONE, Bill.trade_time)), Date)
+    share = BillAmount.price + BillAmount.diff
+
+    def entries(*columns):
+        stmt = select(*columns).join(
+            Bill, same_bill(BillAmount)
+        ).join(
+            payer, payer.party_id == Bill.party_id
+        ).where(Bill.deleted.is_(False))
+        if bill_ids is not None:
+            stmt = stmt.where(Bill.id.in_(list(bill_ids)))
+        return stmt
+
+    return union_all(
+        entries(BillAmount.uid, month, payer.uid, share, literal(0), literal(1)),
+        entries(payer.uid, month, BillAmount.uid, literal(0), share, literal(0)).where(
+            BillAmount.uid != payer.uid
+        )
+    )
+
+
+def remove_from_rollup(bill_ids):
+    # call before the bills are marked deleted
+    update_rollup(
+        (uid, month, counterpart_uid, -spent, -received, -bills)
+        for uid, month, counterpart_uid, spent, received, bills
+        in db.session.execute(rollup_query(bill_ids)).tuples()
+    )
+
+
+def get_monthly_stats(uids: Iterable[str], counterparts: Iterable[str] | None = None,
+                      start: date | None = None, end: date | None = None):
+    stmt = select(
+        MonthlyRollup.month, MonthlyRollup.uid, MonthlyRollup.counterpart_uid,
+        MonthlyRollup.spent, MonthlyRollup.received, MonthlyRollup.bills
+    ).where(
+        MonthlyRollup.uid.in_(list(uids))
+    ).order_by(MonthlyRollup.month, MonthlyRollup.uid, MonthlyRollup.counterpart_uid)
+    if counterparts is not None:
+        stmt = stmt.where(MonthlyRollup.counterpart_uid.in_(list(counterparts)))
+    if start is not None:
+        stmt = stmt.where(MonthlyRollup.month >= start)
+    if end is not None:
+        stmt = stmt.where(MonthlyRollup.month < end)
+    return db.session.execute(stmt).all()
+
+
+def get_balance_by_uid(uid):
+    stmt = select(Balance.counterpart_uid, Balance.amount).where(
+        Balance.uid == uid,
+        Balance.amount != 0
+    )
+    return db.session.execute(stmt).tuples().all()
+
+
+def get_net_positions(members: Iterable[str]):
+    # Net ledger position of each member, counting only debts inside the group
+    members = list(members)
+    stmt = select(Balance.uid, func.sum(Balance.amount)).where(
+        Balance.uid.in_(members),
+        Balance.counterpart_uid.in_(members)
+    ).group_by(Balance.uid)
+    return dict(db.session.execute(stmt).tuples().all())
+
+
+def rebuild_balance(dry_run=False):
+    # Recompute the ledger from the bill tables; returns the drifted pairs as
+    # {(uid, counterpart_uid): (stored, expected)}. Writers change the bill
+    # tables and the ledger in one transaction, so with the ledger locked
+    # each one either committed before the reads below or applies its
+    # delta on top of the rebuilt ledger.
+    mode = "SHARE" if dry_run else "EXCLUSIVE"
+    db.session.execute(text(f"LOCK TABLE {Balance.__table__.fullname} IN {mode} MODE"))
+    expected = defaultdict(Decimal)
+    for debtor, creditor, amount in outstanding_debts():
+        expected[(debtor, creditor)] += amount
+        expected[(creditor, debtor)] -= amount
+    stored = {
+        (uid, counterpart_uid): amount
+        for uid, counterpart_uid, amount in db.session.execute(
+            select(Balance.uid, Balance.counterpart_uid, Balance.amount)
+        ).tuples()
+    }
+    drift = {
+        key: (stored.get(key, Decimal('0')), expected.get(key, Decimal('0')))
+        for key in set(stored) | set(expected)
+        if stored.get(key, Decimal('0')) != expected.get(key, Decimal('0'))
+    }
+
+    if not dry_run:
+        db.session.execute(delete(Balance))
+        if expected:
+            db.session.execute(insert(Balance).values([
+                {"uid": uid, "counterpart_uid": counterpart_uid, "amount": amount}
+                for (uid, counterpart_uid), amount in sorted(expected.items())
+            ]))
+        db.session.commit()
+    return drift
+
+
+def rebuild_rollup(dry_run=False):
+    # Recompute the monthly rollup from the bill tables; returns the drifted
+    # rows as {(uid, month, counterpart_uid): (stored, expected)}. The rollup
+    # is locked like the ledger in rebuild_balance.
+    mode = "SHARE" if dry_run else "EXCLUSIVE"
+    db.session.execute(text(f"LOCK TABLE {MonthlyRollup.__table__.fullname} IN {mode} MODE"))
+
+    def key(row):
+        return row["uid"], row["month"], row["counterpart_uid"]
+
+    def value(row):
+        return row["spent"], row["received"], row["bills"]
+
+    rows = sorted(rollup_rows(db.session.execute(rollup_query()).tuples()), key=key)
+    expected = {key(row): value(row) for row in rows}
+    stored = {
+        key(row): value(row)
+        for row in db.session.execute(select(MonthlyRollup.__table__)).mappings()
+    }
+    zero = (Decimal('0'), Decimal('0'), 0)
+    drift = {
+        k: (stored.get(k, zero), expected.get(k, zero))
+        for k in set(stored) | set(expected)
+        if stored.get(k, zero) != expected.get(k, zero)
+    }
+
+    if not dry_run:
+        db.session.execute(delete(MonthlyRollup))
+        if rows:
+            db.session.execute(
+                text(insert_recordset(MonthlyRollup, list(rows[0]), "monthly_rollup")),
+                {"monthly_rollup": recordset(rows)}
+            )
+        db.session.commit()
+    return drift
+
+
+# Presets of an organization with the ("preset", oid) version they were
+# loaded at, so entries left behind by a write on another worker are ignored
+preset_cache = TTLCache("preset", maxsize=1024, ttl=600)
+
+
+def get_presets(oids: Iterable[str]) -> Dict[str, List[dict]]:
+    # {oid: [{"name", "method", "details"}]}, the presets missing from the
+    # cache loaded in one statement. The result is shared with the cache and
+    # must not be modified.
+    oids = list(oids)
+    if not oids:
+        return {}
+    versions = dict(zip(oids, get_versions(*[("preset", oid) for oid in oids])))
+    result = {}
+    for oid in oids:
+        entry = preset_cache.get(oid)
+        if entry is not None and entry[0] == versions[oid]:
+            result[oid] = entry[1]
+
+    missing = [oid for oid in oids if oid not in result]
+    if missing:
+        stmt = select(
+            ApportionPreset.oid, ApportionPreset.name, ApportionPreset.method, ApportionPreset.details
+        ).where(ApportionPreset.oid.in_(missing)).order_by(ApportionPreset.id)
+        loaded = {oid: [] for oid in missing}
+        for row in db.session.execute(stmt):
+            loaded[row.oid].append({
+                "name": row.name,
+                "method": row.method.value,
+                "details": row.details or []
+            })
+        for oid, presets in loaded.items():
+            preset_cache.set(oid, (versions[oid], presets))
+        result.update(loaded)
+    return result
+
+
+def invalidate_presets(oids=()):
+    for oid in oids:
+        preset_cache.pop(oid)
+
+
+def compute_owed(data: ValidatedBill) -> Dict[str, Decimal]:
+    # Share of the price each counterparty owes, in cents; the round-off
+    # error goes to a random counterparty
+    counterparty_uids = data.counterparty
+    apportions_map = {ap.user: ap.value for ap in data.apportions}
+    total_price = data.price
+    method = data.apportion_method
+
+    if method == ApportionMethod.price:
+        owed = {uid: apportions_map.get(uid, Decimal('0')) for uid in counterparty_uids}
+    elif method == ApportionMethod.ratio:
+        owed = {
+            uid: (total_price * apportions_map[uid] / Decimal('100')).quantize(Decimal('0.01'))
+            for uid in counterparty_uids
+        }
+    elif method == ApportionMethod.share:
+        total_share = sum(apportions_map[uid] for uid in counterparty_uids)
+        owed = {
+            uid: (total_price * apportions_map[uid] / total_share).quantize(Decimal('0.01'))
+            for uid in counterparty_uids
+        }
+    else:
+        raise ValueError(f"Unknown apportion method: {method}")
+
+    # handle round-off error
+    diff = total_price - sum(owed.values(), Decimal('0'))
+    if diff != Decimal('0'):
+        owed[choice(counterparty_uids)] += diff
+    return owed
+
+
+def sequence(model):
+    # SQL drawing the next id of the model's table
+    return f"nextval(pg_get_serial_sequence('{model.__table__.fullname}', 'id'))"
+
+
+def insert_bills(bills: List[Tuple[ValidatedBill, Dict[str, Decimal]]], versions: Iterable[Tuple[str, str]] = ()) -> List[int]:
+    # Write validated bills with their owed shares in two statements whatever
+    # their number: one reserving every id from the sequences, then a chain of
+    # data-modifying CTEs with one INSERT per table plus the ledger and
+    # rollup upserts, the change log and the versions of the participants
+    # plus the given extra ones.
+    # preset ids only for the bills saving one, NULL for the rest
+    presets = [i for i, (data, _) in enumerate(bills, 1) if data.as_apportion_preset]
+    ids = db.session.execute(text(
+        f"SELECT {sequence(Party)}, {sequence(Party)}, {sequence(Bill)}, {sequence(Apportion)}, "
+        f"CASE WHEN i = ANY(:presets) THEN {sequence(ApportionPreset)} END "
+        "FROM generate_series(1, :n) AS i ORDER BY i"
+    ), {"n": len(bills), "presets": presets}).all()
+
+    rows = defaultdict(list)
+    debts = []
+    rollup = []
+    for (data, owed), (party_id, counterparty_id, bill_id, apportion_id, preset_id) in zip(bills, ids):
+        apportions_map = {ap.user: ap.value for ap in data.apportions}
+        rows[Party] += [{"id": party_id}, {"id": counterparty_id}]
+        rows[PartyUser].append({"party_id": party_id, "uid": data.party})
+        rows[PartyUser] += [{"party_id": counterparty_id, "uid": uid} for uid in data.counterparty]
+        rows[Bill].append({
+            "id": bill_id,
+            "trade_time": data.trade_time,
+            "title": data.title,
+            "description": data.description,
+            "price": data.price,
+            "party_id": party_id,
+            "counterparty_id": counterparty_id,
+            "deleted": False,
+            "archived": False
+        })
+        rows[Apportion].append({"id": apportion_id, "bill_id": bill_id, "method": data.apportion_method})
+        rows[ApportionDetail] += [{
+            "apportion_id": apportion_id,
+            "uid": uid,
+            "value": apportions_map.get(uid)
+        } for uid in data.counterparty]
+
+        if data.as_apportion_preset:
+            rows[ApportionPreset].append({
+                "id": preset_id,
+                "name": data.apportion_preset_title,
+                "oid": data.apportion_preset_organization_id,
+                "method": data.apportion_method,
+                "details": [{"uid": uid, "value": apportions_map.get(uid)} for uid in data.counterparty]
+            })
+            rows[ApportionPresetDetail] += [{
+                "apportion_preset_id": preset_id,
+                "uid": uid,
+                "value": apportions_map.get(uid)
+            } for uid in data.counterparty]
+
+        amounts = {uid: {
+            "bill_id": bill_id,
+            "uid": uid,
+            "price": Decimal('0'),
+            "diff": owed[uid],
+            "completed": False,
+            "trade_time": data.trade_time,
+            "archived": False
+        } for uid in data.counterparty}
+        amounts[data.party] = {
+            "bill_id": bill_id,
+            "uid": data.party,
+            "price": data.price,
+            "diff": owed.get(data.party, Decimal('0')) - data.price,
+            "completed": False,
+            "trade_time": data.trade_time,
+            "archived": False
+        }
+        rows[BillAmount] += amounts.values()
+        rows[ChangeLog] += change_rows(ChangeOp.create, [(bill_id, amounts)])
+        debts += [(uid, data.party, owed[uid]) for uid in data.counterparty]
+        rollup += rollup_entries(stats_month(data.trade_time), data.party, {
+            uid: amount["price"] + amount["diff"] for uid, amount in amounts.items()
+        })
+
+    rows[Balance] = balance_rows(debts)
+    rows[MonthlyRollup] = rollup_rows(rollup)
+    rows[Version] = version_rows([("user", uid) for row in rows[ChangeLog] for uid in row["uids"]] + list(versions))
+    models = [model for model in (
+        Party, PartyUser, Bill, Apportion, ApportionDetail,
+        ApportionPreset, ApportionPresetDetail, BillAmount, Balance, MonthlyRollup, ChangeLog, Version
+    ) if rows[model]]
+    stmts = [insert_recordset(model, list(rows[model][0]), model.__tablename__) for model in models]
+    *ctes, stmt = stmts
+    db.session.execute(
+        text("WITH " + ", ".join(f"insert_{i} AS ({sql})" for i, sql in enumerate(ctes)) + f" {stmt}"),
+        {model.__tablename__: recordset(rows[model]) for model in models}
+    )
+    return [bill_id for _, _, bill_id, _, _ in ids]
@@ -1,13 +1,17 @@
 from pydantic import BaseModel, Field, ValidationInfo, field_validator, model_validator
-from typing import List, Any
+from typing import Callable, Dict, Iterable, List, Any
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime
 
 
-from common.util import get_user_by_id
+from common.util import get_users_by_ids
 from bill.db import ApportionMethod
 
 
+# uids -> {uid: user, or None when it does not exist}
+UserResolver = Callable[[Iterable[str]], Dict[str, dict | None]]
+
+
 class ApportionItem(BaseModel):
     user: str = Field(..., min_length=1, max_length=32)
     value: Decimal = Field(..., ge=0)
@@ -66,8 +70,15 @@ class ValidatedBill(BaseModel):
     @model_validator(mode='after')
     def check_apportions_and_uids(self, info: ValidationInfo) -> 'ValidatedBill':
         all_uids = {self.party} | set(self.counterparty)
-        missing = [uid for uid in all_uids if get_user_by_id(uid) is None]
-        if not all([get_user_by_id(uid) is not None for uid in all_uids]):
+        # bulk callers pass the users they already resolved as context, others
+        # may plug in their own resolver; every uid is looked up once, in batch
+        context = info.context or {}
+        users = context.get("users")
+        if users is None:
+            resolver: UserResolver = context.get("resolver", get_users_by_ids)
+            users = resolver(all_uids)
+        missing = sorted(uid for uid in all_uids if users.get(uid) is None)
+        if missing:
             raise ValueError(f"UID not found in account system: {missing}")
 
         apportion_users = [ap.user for ap in self.apportions]
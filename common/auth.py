@@ -2,9 +2,18 @@ from functools import wraps
 from flask import g, request, current_app, abort
 
 
-import requests
+import threading
+import tempfile
+import hashlib
+import fcntl
+import json
 import time
 import jwt
+import os
+
+
+from common.cache import TTLCache, register_stats
+from common.logto import logto
 
 
 def get_auth_token():
@@ -30,13 +39,13 @@ def get_m2m_token():
     if not all([token_endpoint, resource, client_id, client_secret]):
         raise RuntimeError("Missing Logto M2M configuration in app.config")
     
-    resp = requests.post(token_endpoint, data={
+    resp = logto.post(token_endpoint, endpoint="token", data={
         'grant_type': 'client_credentials',
         'client_id': client_id,
         'client_secret': client_secret,
         'resource': resource,
         'scope': 'all'
-    }, timeout=10)
+    })
     
     if resp.status_code != 200:
         current_app.logger.error(f"Failed to get Logto token: {resp.text}")
@@ -47,43 +56,239 @@ def get_m2m_token():
     expires_in = data.get('expires_in', 3600)
     return {
        'access_token': access_token,
+       'issued_at': time.time(),
        'expires_at': time.time() + expires_in - 60
     }
 
 
+class JWKSCache:
+    # Process-wide store of the Logto signing keys, keyed by `kid`.
+    # Stale key sets are refreshed in the background while the old keys keep
+    # serving requests; an unknown `kid` forces one synchronous refetch.
+    def __init__(self, ttl=3600, refetch_interval=30):
+        self.ttl = ttl
+        self.refetch_interval = refetch_interval
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self._uri = None
+        self._keys = {}
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+            "keys": len(self._keys),
+            "age": time.time() - self._fetched_at if self._fetched_at else None
+        }
+
+    def _fetch(self, uri):
+        resp = logto.get(uri, endpoint="jwks")
+        resp.raise_for_status()
+        jwk_set = jwt.PyJWKSet.from_dict(resp.json())
+        self._keys = {key.key_id: key for key in jwk_set.keys}
+        self._uri = uri
+        self._fetched_at = time.time()
+        self.fetches += 1
+
+    def _refresh_in_background(self, app, uri):
+        try:
+            with self._lock:
+                self._fetch(uri)
+        except Exception as e:
+            app.logger.warning(f"Background JWKS refresh failed: {e}")
+        finally:
+            self._refreshing.release()
+
+    def get_signing_key(self, uri, kid):
+        key = self._keys.get(kid) if self._uri == uri else None
+        if key is not None:
+            self.hits += 1
+            if time.time() - self._fetched_at > self.ttl and self._refreshing.acquire(blocking=False):
+                threading.Thread(
+                    target=self._refresh_in_background,
+                    args=(current_app._get_current_object(), uri),
+                    daemon=True
+                ).start()
+            return key
+
+        self.misses += 1
+        fetched_at = self._fetched_at
+        with self._lock:
+            # Another thread refetched while we waited, or we refetched too
+            # recently to trust that the kid really is unknown.
+            if self._fetched_at == fetched_at and (
+                self._uri != uri or time.time() - self._fetched_at >= self.refetch_interval
+            ):
+                self._fetch(uri)
+        key = self._keys.get(kid) if self._uri == uri else None
+        if key is None:
+            raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+
+jwks_cache = JWKSCache()
+register_stats("jwks", jwks_cache.stats)
+# Verified JWT payloads keyed by token digest, kept until the token expires
+token_cache = TTLCache("token", maxsize=4096)
+TOKEN_LEEWAY = 30
+
+
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = get_auth_token()
-        jwks = jwt.PyJWKClient(current_app.config.get("LOGTO")["endpoint"]["jwksuri"]).get_signing_key_from_jwt(token)
+        digest = hashlib.sha256(token.encode()).hexdigest() if token else None
+        payload = token_cache.get(digest) if digest else None
+        if payload is not None:
+            g.current_user = payload
+            return f(*args, **kwargs)
+
+        jwks = jwks_cache.get_signing_key(
+            current_app.config.get("LOGTO")["endpoint"]["jwksuri"],
+            jwt.get_unverified_header(token).get('kid')
+        )
         payload = jwt.decode(
             token,
             jwks.key,
             algorithms=[jwt.get_unverified_header(token).get('alg')],
             audience=current_app.config.get("LOGTO")["api"]["dormitory"],
             issuer=current_app.config.get("LOGTO")["endpoint"]["issuer"],
-            leeway=30,
+            leeway=TOKEN_LEEWAY,
             options={
                 'verify_at_hash': False
             }
         )
+        if "exp" in payload:
+            token_cache.set(digest, payload, expires_at=payload["exp"] + TOKEN_LEEWAY)
         g.current_user = payload
         return f(*args, **kwargs)
     return decorated
 
 
-def with_logto_token(f):
-    cache = {
-        'access_token': None,
-        'expires_at': 0
-    }
+class M2MTokenManager:
+    # One Logto M2M token per process, optionally shared with the other
+    # workers through a file. Requests never wait while the current token is
+    # valid: it is renewed in the background `refresh_ahead` seconds before it
+    # expires, and only one caller (per host, with a share file) hits Logto.
+    def __init__(self, refresh_ahead=300):
+        self.refresh_ahead = refresh_ahead
+        self.refreshes = 0
+        self._token = {
+            'access_token': None,
+            'issued_at': 0,
+            'expires_at': 0
+        }
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def _options(self, app):
+        return app.config.get("LOGTO").get("token", {})
+
+    def _read_shared(self, path):
+        try:
+            with open(path) as file:
+                token = json.load(file)
+        except (OSError, ValueError):
+            return
+        if token.get('expires_at', 0) > self._token['expires_at']:
+            self._token = token
 
+    def _write_shared(self, path):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "w") as file:
+            json.dump(self._token, file)
+        os.replace(tmp, path)
+
+    def _refresh(self, app, rejected=None):
+        # `rejected` is a token Logto answered 401 to; it is replaced unless
+        # another thread or worker already did
+        with self._lock, app.app_context():
+            path = self._options(app).get("share_file")
+            if path is None:
+                if self._is_rejected(rejected) or self._needs_refresh(app):
+                    self._token = get_m2m_token()
+                    self.refreshes += 1
+                return
+
+            with open(f"{path}.lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._read_shared(path)
+                if self._is_rejected(rejected) or self._needs_refresh(app):
+                    self._token = get_m2m_token()
+                    self.refreshes += 1
+                    self._write_shared(path)
+
+    def _is_rejected(self, rejected):
+        return rejected is not None and self._token['access_token'] == rejected
+
+    def _needs_refresh(self, app):
+        token = self._token
+        # never renew more often than every half lifetime of a token
+        ahead = min(
+            self._options(app).get("refresh_ahead", self.refresh_ahead),
+            (token['expires_at'] - token.get('issued_at', 0)) / 2
+        )
+        return token['expires_at'] - time.time() <= ahead
+
+    def _refresh_in_background(self, app):
+        try:
+            self._refresh(app)
+        except Exception as e:
+            app.logger.warning(f"Background Logto token refresh failed: {e}")
+        finally:
+            self._refreshing.release()
+
+    def get_token(self):
+        app = current_app._get_current_object()
+        token = self._token
+        if token['access_token'] is None or token['expires_at'] <= time.time():
+            self._refresh(app)
+        elif self._needs_refresh(app) and self._refreshing.acquire(blocking=False):
+            threading.Thread(
+                target=self._refresh_in_background,
+                args=(app,),
+                daemon=True
+            ).start()
+        return self._token['access_token']
+
+    def invalidate(self, rejected):
+        self._refresh(current_app._get_current_object(), rejected=rejected)
+
+    def stats(self):
+        return {
+            "refreshes": self.refreshes,
+            "expires_in": self._token['expires_at'] - time.time()
+        }
+
+
+m2m_token = M2MTokenManager()
+register_stats("m2m_token", m2m_token.stats)
+
+
+def with_logto_token(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        now = time.time()
-        if cache['access_token'] is None or cache['expires_at'] <= now:
-            cache.update(get_m2m_token())
-        
-        g.logto_access_token = cache['access_token']
+        g.logto_access_token = m2m_token.get_token()
         return f(*args, **kwargs)
     return decorated
+
+
+def logto_get(url, endpoint, **kwargs):
+    # GET on the Logto Management API with the token of with_logto_token.
+    # A 401 means the token was revoked or the signing keys rotated before
+    # it expired: it is renewed once and the call repeated.
+    resp = logto.get(url, endpoint=endpoint, headers={
+        "Authorization": f"Bearer {g.logto_access_token}",
+    }, **kwargs)
+    if resp.status_code == 401:
+        m2m_token.invalidate(g.logto_access_token)
+        g.logto_access_token = m2m_token.get_token()
+        resp = logto.get(url, endpoint=endpoint, headers={
+            "Authorization": f"Bearer {g.logto_access_token}",
+        }, **kwargs)
+    return resp
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+
+import threading
+import time
+
+
+MISSING = object()
+caches = {}
+# counters of other per-process components, logged along with the caches
+stats_sources = {}
+# seconds between two cache stats log lines of a process, 0 to disable
+STATS_INTERVAL = 3600
+
+
+class TTLCache:
+    # Bounded LRU mapping whose entries expire individually. Instances are
+    # registered by name so `init_caches` can size them from config.toml.
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, MISSING)
+            if entry is not MISSING and entry[1] is not None and entry[1] <= time.time():
+                del self._data[key]
+                entry = MISSING
+            if entry is MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        if expires_at is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, MISSING)
+        return default if entry is MISSING else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else None
+        }
+
+
+def init_caches(app):
+    for name, options in app.config.get('CACHE', {}).items():
+        if name in caches:
+            caches[name].configure(
+                maxsize=options.get("size"),
+                ttl=options.get("ttl")
+            )
+    interval = app.config.get('CACHE', {}).get("stats_interval", STATS_INTERVAL)
+    if interval:
+        threading.Thread(
+            target=log_cache_stats, args=(app, interval), name="cache-stats", daemon=True
+        ).start()
+
+
+def register_stats(name, stats):
+    # `stats` returns the counters of `name` for log_cache_stats
+    stats_sources[name] = stats
+
+
+def log_cache_stats(app, interval):
+    # Every worker has caches of its own, so each one logs its own counters
+    while True:
+        time.sleep(interval)
+        for name, stats in cache_stats().items():
+            app.logger.info(f"Cache {name}: {stats}")
+        for name, stats in stats_sources.items():
+            app.logger.info(f"Stats {name}: {stats()}")
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -11,3 +11,17 @@ class Base(db.Model):
 
 class BaseNoID(db.Model):
     __abstract__ = True
+
+
+class BaseCommon(BaseNoID):
+    __abstract__ = True
+    __table_args__ = {'schema': 'common'}
+
+
+class Version(BaseCommon):
+    # Counter bumped by every write changing what is read under (scope, key),
+    # e.g. the bills of a user or the stats of a building. Read endpoints
+    # derive their ETag from it.
+    scope = db.Column(db.Text, primary_key=True)
+    key = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
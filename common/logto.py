@@ -0,0 +1,91 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+import threading
+import requests
+import time
+import os
+
+
+from common.cache import register_stats
+
+
+class LogtoClient:
+    # Keep-alive HTTP client for every outbound call to Logto. The pooled
+    # session is created lazily in each (forked) worker process, retries
+    # idempotent calls on 429/5xx with backoff and records latency per
+    # endpoint label.
+    def __init__(self, pool_size=16, timeout=(3.05, 10), retries=3, backoff=0.3):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._latency = {}
+
+    def init_app(self, app):
+        options = app.config.get("LOGTO", {}).get("client", {})
+        self.pool_size = options.get("pool_size", self.pool_size)
+        self.timeout = tuple(options["timeout"]) if "timeout" in options else self.timeout
+        self.retries = options.get("retries", self.retries)
+        self.backoff = options.get("backoff", self.backoff)
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    retry = Retry(
+                        total=self.retries,
+                        backoff_factor=self.backoff,
+                        status_forcelist=(429, 500, 502, 503, 504),
+                        allowed_methods=frozenset(["GET", "POST"]),
+                        raise_on_status=False
+                    )
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_size,
+                        pool_maxsize=self.pool_size,
+                        max_retries=retry
+                    )
+                    session = requests.Session()
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def request(self, method, url, endpoint=None, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            self._record(endpoint or method, time.perf_counter() - start)
+
+    def get(self, url, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def _record(self, endpoint, elapsed):
+        with self._lock:
+            stat = self._latency.setdefault(endpoint, {"count": 0, "total": 0.0, "max": 0.0})
+            stat["count"] += 1
+            stat["total"] += elapsed
+            stat["max"] = max(stat["max"], elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                endpoint: stat | {"avg": stat["total"] / stat["count"]}
+                for endpoint, stat in self._latency.items()
+            }
+
+
+logto = LogtoClient()
+register_stats("logto", logto.stats)
@@ -3,7 +3,7 @@ from flask import Blueprint, request, make_response, g, abort
 
 from common.auth import require_auth, with_logto_token
 from common.util import (
-    get_user_by_username,
+    search_users_by_prefix,
     get_organizations_by_uid,
     get_organizations_member_by_id
 )
@@ -17,7 +17,9 @@ common = Blueprint('common', __name__, url_prefix="/common")
 @with_logto_token
 def query_username():
     username = request.args.get("username")
-    users = get_user_by_username(f"{username}%")
+    if username is None:
+        abort(400)
+    users = search_users_by_prefix(username)
 
     if len(users) == 0:
         return make_response('', 204)
@@ -1,14 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
 from flask import g, current_app
+from itertools import batched
+from typing import Dict, Iterable, List
 
 
-import requests
+import threading
+
+
+from common.cache import TTLCache, MISSING
+from common.auth import logto_get
+from common.version import get_versions
+from directory import util as directory
+
+
+# Logto user profiles by uid; unknown uids are cached as None for a short while.
+# Entries of these three caches are (version, value), see cache_get.
+user_cache = TTLCache("user", maxsize=4096, ttl=600)
+USER_NEGATIVE_TTL = 30
+# organizations of a user and members of an organization
+organization_cache = TTLCache("organization", maxsize=2048, ttl=300)
+member_cache = TTLCache("member", maxsize=1024, ttl=300)
+# uids per `search.id` query when resolving users in batch
+USER_BATCH_SIZE = 50
+
+# Shared pool for outbound calls; a single request never holds more than
+# FAN_OUT_LIMIT of its workers at once.
+executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="fan-out")
+FAN_OUT_LIMIT = 8
+
+
+def fan_out(func, items, limit=FAN_OUT_LIMIT):
+    # Run func over items on the shared executor and return the results in
+    # order, with the caller's app context and `g` (e.g. the Logto token)
+    # available in every call. Must not be called from inside a fan_out task.
+    # Tasks must not use the database either: each app context would check
+    # out a pooled connection of its own.
+    app = current_app._get_current_object()
+    context = {key: g.get(key) for key in g}
+    slots = threading.BoundedSemaphore(limit)
+
+    def call(item):
+        with app.app_context():
+            for key, value in context.items():
+                setattr(g, key, value)
+            return func(item)
+
+    futures = []
+    for item in items:
+        slots.acquire()
+        future = executor.submit(call, item)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    return [future.result() for future in futures]
+
+
+def directory_key(cache, key):
+    # Version of one entry of the caches above. Webhooks and syncs bump it
+    # where they drop the local copy. Not ("user", uid), which every bill of
+    # the user bumps.
+    return (f"directory.{cache.name}", key)
+
+
+def directory_keys(users=(), organizations=(), members=()):
+    # version keys of the user_cache and organization_cache entries of the
+    # given uids and of the member_cache entries of the given oids
+    return [directory_key(user_cache, uid) for uid in users] + \
+        [directory_key(organization_cache, uid) for uid in organizations] + \
+        [directory_key(member_cache, oid) for oid in members]
+
+
+def directory_versions(keys):
+    # Versions of directory keys, each read once per request and before the
+    # entry it guards is loaded. Webhooks and syncs bump the keys they change,
+    # so a change handled by one worker reaches the caches of every worker.
+    read = g.setdefault("directory_versions", {})
+    missing = [key for key in dict.fromkeys(keys) if key not in read]
+    if missing:
+        read.update(zip(missing, get_versions(*missing)))
+    return [read[key] for key in keys]
+
+
+def read_directory_versions():
+    # every directory key this request has read so far, for ETags
+    return sorted(g.get("directory_versions", {}).items())
+
+
+def cache_get(cache, key):
+    entry = cache.get(key)
+    if entry is None or entry[0] != directory_versions([directory_key(cache, key)])[0]:
+        return MISSING
+    return entry[1]
+
+
+def cache_set(cache, key, value, ttl=None):
+    cache.set(key, (directory_versions([directory_key(cache, key)])[0], value), ttl=ttl)
 
 
 def get_user_by_username(username):
-    resp = requests.get(current_app.config.get("LOGTO")["endpoint"]["user"],
-        headers={
-            "Authorization": f"Bearer {g.logto_access_token}",
-        },
+    resp = logto_get(current_app.config.get("LOGTO")["endpoint"]["user"],
+        endpoint="users.search",
         params={
             "search.username": username,
             "page": 1,
@@ -19,40 +109,155 @@ def get_user_by_username(username):
     return resp.json()
 
 
-def get_user_by_id(uid):
-    resp = requests.get(f'{current_app.config.get("LOGTO")["endpoint"]["user"]}/{uid}',
-        headers={
-            "Authorization": f"Bearer {g.logto_access_token}",
-        },
+def search_users_by_prefix(prefix):
+    if directory.directory_ready():
+        return directory.search_users(prefix)
+    return get_user_by_username(f"{prefix}%")
+
+
+def fetch_user(uid):
+    # Logto only, unknown uids as None; safe to fan out
+    resp = logto_get(f'{current_app.config.get("LOGTO")["endpoint"]["user"]}/{uid}',
+        endpoint="users.get",
     )
     if resp.status_code == 404:
         return None
-    
+
     resp.raise_for_status()
     return resp.json()
 
 
+def cache_user(uid, user):
+    if user is None:
+        negative_ttl = current_app.config.get("CACHE", {}).get("user", {}).get("negative_ttl", USER_NEGATIVE_TTL)
+        cache_set(user_cache, uid, None, ttl=negative_ttl)
+    else:
+        cache_set(user_cache, uid, user)
+
+
+def get_users_by_ids(uids: Iterable[str]) -> Dict[str, dict | None]:
+    result = {}
+    missing = []
+    uids = set(uids)
+    directory_versions(directory_keys(users=uids))
+    for uid in uids:
+        user = cache_get(user_cache, uid)
+        if user is MISSING:
+            missing.append(uid)
+        else:
+            result[uid] = user
+
+    if missing and directory.directory_ready():
+        for uid, user in directory.get_users(missing).items():
+            cache_set(user_cache, uid, user)
+            result[uid] = user
+        missing = [uid for uid in missing if uid not in result]
+
+    for chunk in batched(missing, USER_BATCH_SIZE):
+        resp = logto_get(current_app.config.get("LOGTO")["endpoint"]["user"],
+            endpoint="users.search",
+            params={
+                "search.id": list(chunk),
+                "mode.id": "exact",
+                "page": 1,
+                "page_size": len(chunk)
+            }
+        )
+        resp.raise_for_status()
+        for user in resp.json():
+            cache_set(user_cache, user["id"], user)
+            result[user["id"]] = user
+
+    # whatever the search did not return is looked up (and negatively cached) one by one
+    rest = [uid for uid in missing if uid not in result]
+    for uid, user in zip(rest, fan_out(fetch_user, rest)):
+        cache_user(uid, user)
+        result[uid] = user
+    return result
+
+
+def invalidate_user(uid=None):
+    # Drops the local copies only; other workers stop using theirs once the
+    # version bump committed with the change is visible.
+    if uid is None:
+        user_cache.clear()
+    else:
+        user_cache.pop(uid)
+
+
 def get_organizations_by_uid(uid):
-    resp = requests.get(f'{current_app.config.get("LOGTO")["endpoint"]["user"]}/{uid}/organizations',
-        headers={
-            "Authorization": f"Bearer {g.logto_access_token}",
-        },
+    orgs = cache_get(organization_cache, uid)
+    if orgs is not MISSING:
+        return orgs
+
+    if directory.directory_ready():
+        orgs = directory.get_user_organizations(uid)
+        if orgs is not None:
+            cache_set(organization_cache, uid, orgs)
+            return orgs
+
+    resp = logto_get(f'{current_app.config.get("LOGTO")["endpoint"]["user"]}/{uid}/organizations',
+        endpoint="users.organizations",
     )
     if resp.status_code == 404:
         return None
     
     resp.raise_for_status()
-    return resp.json()
+    orgs = resp.json()
+    cache_set(organization_cache, uid, orgs)
+    return orgs
 
 
-def get_organizations_member_by_id(oid):
-    resp = requests.get(f'{current_app.config.get("LOGTO")["endpoint"]["organization"]}/{oid}/users',
-        headers={
-            "Authorization": f"Bearer {g.logto_access_token}",
-        },
+def fetch_organization_members(oid):
+    # Logto only, unknown organizations as None; safe to fan out
+    resp = logto_get(f'{current_app.config.get("LOGTO")["endpoint"]["organization"]}/{oid}/users',
+        endpoint="organizations.users",
     )
     if resp.status_code == 404:
         return None
-    
+
     resp.raise_for_status()
     return resp.json()
+
+
+def get_organizations_members(oids: Iterable[str]) -> Dict[str, List[dict] | None]:
+    # Cache and mirror are read on the calling thread and only the Logto
+    # calls are fanned out, so the request keeps to its one DB connection.
+    result = {}
+    missing = []
+    oids = list(dict.fromkeys(oids))
+    directory_versions(directory_keys(members=oids))
+    for oid in oids:
+        members = cache_get(member_cache, oid)
+        if members is MISSING:
+            missing.append(oid)
+        else:
+            result[oid] = members
+
+    if missing and directory.directory_ready():
+        for oid in missing:
+            members = directory.get_organization_users(oid)
+            if members is not None:
+                cache_set(member_cache, oid, members)
+                result[oid] = members
+        missing = [oid for oid in missing if oid not in result]
+
+    for oid, members in zip(missing, fan_out(fetch_organization_members, missing)):
+        if members is not None:
+            cache_set(member_cache, oid, members)
+        result[oid] = members
+    return result
+
+
+def get_organizations_member_by_id(oid):
+    return get_organizations_members([oid])[oid]
+
+
+def invalidate_organizations(uids=()):
+    for uid in uids:
+        organization_cache.pop(uid)
+
+
+def invalidate_members(oids=()):
+    for oid in oids:
+        member_cache.pop(oid)
@@ -0,0 +1,67 @@
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, tuple_
+from flask import request, make_response
+from typing import Iterable, List, Tuple
+
+
+import hashlib
+import json
+
+
+from common.db import db, Version
+
+
+# scopes without a key of their own
+ELEC_CATALOG = ("catalog", "elec")
+
+
+def version_rows(keys: Iterable[Tuple[str, str]]) -> List[dict]:
+    # rows adding one to each (scope, key), in key order so concurrent
+    # writers lock the counters consistently
+    return [
+        {"scope": scope, "key": key, "version": 1}
+        for scope, key in sorted({(scope, str(key)) for scope, key in keys})
+    ]
+
+
+def bump_versions(keys: Iterable[Tuple[str, str]]):
+    # call inside the transaction of the write
+    rows = version_rows(keys)
+    if rows:
+        stmt = insert(Version).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[Version.scope, Version.key],
+            set_={"version": Version.version + 1}
+        ))
+
+
+def get_versions(*keys: Tuple[str, str]) -> List[int]:
+    # Read before the data they describe: a write landing in between then
+    # only makes the ETag older than the response, never newer.
+    keys = [(scope, str(key)) for scope, key in keys]
+    stmt = select(Version.scope, Version.key, Version.version).where(
+        tuple_(Version.scope, Version.key).in_(keys)
+    )
+    found = {(scope, key): version for scope, key, version in db.session.execute(stmt).all()}
+    return [found.get(key, 0) for key in keys]
+
+
+def etag(*parts) -> str:
+    # strong validator of a response determined by the given versions and parameters
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def is_fresh(tag) -> bool:
+    # whether a GET already holds the `tag` representation; other methods
+    # ignore If-None-Match here rather than answer 412
+    return request.method in ("GET", "HEAD") and request.if_none_match.contains(tag)
+
+
+def not_modified(tag):
+    return with_etag(('', 304), tag)
+
+
+def with_etag(response, tag):
+    response = make_response(response)
+    response.set_etag(tag)
+    return response
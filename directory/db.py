@@ -0,0 +1,49 @@
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+from common.db import db, BaseNoID
+
+
+class BaseDirectory(BaseNoID):
+    __abstract__ = True
+    __table_args__ = {'schema': 'directory'}
+
+
+# Local mirror of Logto, keyed by Logto ids and filled by directory.sync
+class DirectoryUser(BaseDirectory):
+    __tablename__ = 'users'
+    __table_args__ = (
+        db.Index(
+            'ix_directory_users_username_prefix',
+            db.func.lower(db.text('username')).label('username'),
+            postgresql_ops={'username': 'text_pattern_ops'}
+        ),
+        BaseDirectory.__table_args__
+    )
+    id = db.Column(db.String(32), primary_key=True)
+    username = db.Column(db.Text)
+    updated_at = db.Column(db.BigInteger)  # Logto `updatedAt`, epoch ms
+    data = db.Column(JSONB)
+
+
+class DirectoryOrganization(BaseDirectory):
+    __tablename__ = 'organizations'
+    id = db.Column(db.String(32), primary_key=True)
+    name = db.Column(db.Text)
+    data = db.Column(JSONB)
+
+
+class DirectoryMembership(BaseDirectory):
+    __tablename__ = 'memberships'
+    __table_args__ = (
+        db.Index('ix_directory_memberships_uid', 'uid'),
+        BaseDirectory.__table_args__
+    )
+    organization_id = db.Column(db.String(32), primary_key=True)
+    uid = db.Column(db.String(32), primary_key=True)
+
+
+class DirectorySyncState(BaseDirectory):
+    __tablename__ = 'sync_state'
+    name = db.Column(db.Text, primary_key=True)
+    synced_at = db.Column(db.DateTime(timezone=True))
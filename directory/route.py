@@ -0,0 +1,88 @@
+from flask import Blueprint, request, make_response, current_app, abort
+
+
+from common.util import directory_keys, invalidate_user, invalidate_organizations, invalidate_members
+from common.version import bump_versions
+from directory.util import verify_signature
+from directory.sync import (
+    db,
+    sync_organization_members, get_member_uids, get_organization_ids,
+    upsert_user, delete_user, upsert_organization, delete_organization
+)
+
+
+directory = Blueprint('directory', __name__, url_prefix="/directory")
+
+
+def handle_user_event(event, payload):
+    user = payload.get("data") or {}
+    uid = user.get("id") or payload.get("params", {}).get("userId")
+    if uid is None:
+        return []
+
+    oids = get_organization_ids(uid)
+    if event == "User.Deleted":
+        delete_user(uid)
+    elif "username" in user:
+        upsert_user(user)
+    invalidate_user(uid)
+    invalidate_organizations([uid])
+    invalidate_members(oids)
+    return directory_keys(users=[uid], organizations=[uid], members=oids)
+
+
+def handle_organization_event(event, payload):
+    org = payload.get("data") or {}
+    oid = org.get("id") or payload.get("organizationId") or payload.get("params", {}).get("id")
+    if oid is None:
+        return []
+
+    uids = get_member_uids(oid)
+    if event == "Organization.Deleted":
+        delete_organization(oid)
+    elif event == "Organization.Membership.Updated":
+        # the event does not say who joined or left, so resync this organization only
+        added, removed = sync_organization_members(oid)
+        uids |= added | removed
+    elif "name" in org:
+        upsert_organization(org)
+    invalidate_organizations(uids)
+    invalidate_members([oid])
+    return directory_keys(organizations=uids, members=[oid])
+
+
+HANDLERS = {
+    "User.Created": handle_user_event,
+    "User.Data.Updated": handle_user_event,
+    "User.SuspensionStatus.Updated": handle_user_event,
+    "User.Deleted": handle_user_event,
+    "Organization.Created": handle_organization_event,
+    "Organization.Data.Updated": handle_organization_event,
+    "Organization.Deleted": handle_organization_event,
+    "Organization.Membership.Updated": handle_organization_event,
+}
+
+
+@directory.route("/webhook", methods=['POST'])
+def logto_webhook():
+    signing_key = current_app.config.get("LOGTO").get("webhook", {}).get("signingKey")
+    body = request.get_data()
+    if not verify_signature(signing_key, body, request.headers.get("logto-signature-sha-256")):
+        abort(401)
+
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict):
+        abort(400)
+
+    handler = HANDLERS.get(payload.get("event"))
+    if handler is None:
+        return make_response('', 204)
+
+    try:
+        bump_versions(handler(payload["event"], payload))
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(f"Failed to handle Logto webhook {payload.get('event')}: {e}")
+        db.session.rollback()
+        abort(500)
+    return make_response('', 204)
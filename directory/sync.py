@@ -0,0 +1,219 @@
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, delete, or_
+from datetime import datetime, timezone
+from flask import current_app, g
+from itertools import batched
+
+
+from common.auth import m2m_token, logto_get
+from common.util import directory_keys
+from common.version import bump_versions
+from directory.db import (
+    db,
+    DirectoryUser, DirectoryOrganization, DirectoryMembership, DirectorySyncState
+)
+
+
+PAGE_SIZE = 100
+UPSERT_BATCH_SIZE = 500
+
+
+def paginate(url, endpoint):
+    page = 1
+    while True:
+        # a sync can outlive a token, so take the current one for each page
+        g.logto_access_token = m2m_token.get_token()
+        resp = logto_get(url,
+            endpoint=endpoint,
+            params={
+                "page": page,
+                "page_size": PAGE_SIZE
+            }
+        )
+        resp.raise_for_status()
+        items = resp.json()
+        yield from items
+        if len(items) < PAGE_SIZE:
+            return
+        page += 1
+
+
+def upsert(model, rows, columns):
+    for chunk in batched(rows, UPSERT_BATCH_SIZE):
+        stmt = insert(model).values(list(chunk))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.id],
+            set_={column: stmt.excluded[column] for column in columns}
+        )
+        db.session.execute(stmt)
+
+
+def related_keys(uids=(), oids=()):
+    # Directory keys of the given users and organizations and of the other
+    # side of their memberships: a user is listed among the members of each
+    # organization, an organization among the organizations of each member.
+    # Read before the memberships are deleted.
+    uids, oids = set(uids), set(oids)
+    if not uids and not oids:
+        return []
+    stmt = select(DirectoryMembership.uid, DirectoryMembership.organization_id).where(or_(
+        DirectoryMembership.uid.in_(uids),
+        DirectoryMembership.organization_id.in_(oids)
+    ))
+    members = set(uids)
+    organizations = set(oids)
+    for uid, oid in db.session.execute(stmt).all():
+        if uid in uids:
+            organizations.add(oid)
+        if oid in oids:
+            members.add(uid)
+    return directory_keys(users=uids, organizations=members, members=organizations)
+
+
+def fetch_directory():
+    # Everything the sync needs from Logto, read before the first statement:
+    # a transaction held open across hundreds of Logto calls would hold back
+    # the snapshot horizon of the change feed for as long.
+    url = current_app.config.get("LOGTO")["endpoint"]
+    users = list(paginate(url["user"], "users.list"))
+    organizations = list(paginate(url["organization"], "organizations.list"))
+    members = {org["id"]: fetch_member_uids(org["id"]) for org in organizations}
+    return users, organizations, members
+
+
+def fetch_member_uids(oid):
+    url = current_app.config.get("LOGTO")["endpoint"]["organization"]
+    return set(user["id"] for user in paginate(f"{url}/{oid}/users", "organizations.users"))
+
+
+def sync_users(users):
+    known = dict(db.session.execute(select(DirectoryUser.id, DirectoryUser.updated_at)).all())
+    changed = []
+    seen = set()
+    for user in users:
+        seen.add(user["id"])
+        if known.get(user["id"]) != user.get("updatedAt"):
+            changed.append({
+                "id": user["id"],
+                "username": user.get("username"),
+                "updated_at": user.get("updatedAt"),
+                "data": user
+            })
+
+    removed = set(known) - seen
+    keys = related_keys(uids=[user["id"] for user in changed] + list(removed))
+    upsert(DirectoryUser, changed, ["username", "updated_at", "data"])
+    for chunk in batched(removed, UPSERT_BATCH_SIZE):
+        db.session.execute(delete(DirectoryUser).where(DirectoryUser.id.in_(chunk)))
+        db.session.execute(delete(DirectoryMembership).where(DirectoryMembership.uid.in_(chunk)))
+    return {"changed": len(changed), "removed": len(removed)}, keys
+
+
+def sync_organizations(organizations, members):
+    known = dict(db.session.execute(select(DirectoryOrganization.id, DirectoryOrganization.data)).all())
+    changed = []
+    for org in organizations:
+        if known.pop(org["id"], None) != org:
+            changed.append({
+                "id": org["id"],
+                "name": org.get("name"),
+                "data": org
+            })
+
+    removed = list(known)
+    keys = related_keys(oids=[org["id"] for org in changed] + removed)
+    upsert(DirectoryOrganization, changed, ["name", "data"])
+    for chunk in batched(removed, UPSERT_BATCH_SIZE):
+        db.session.execute(delete(DirectoryOrganization).where(DirectoryOrganization.id.in_(chunk)))
+        db.session.execute(delete(DirectoryMembership).where(DirectoryMembership.organization_id.in_(chunk)))
+
+    joined = left = 0
+    for oid, uids in members.items():
+        added, removed_uids = sync_organization_members(oid, uids)
+        joined += len(added)
+        left += len(removed_uids)
+        if added or removed_uids:
+            keys += directory_keys(organizations=added | removed_uids, members=[oid])
+    return {
+        "changed": len(changed),
+        "removed": len(removed),
+        "joined": joined,
+        "left": left
+    }, keys
+
+
+def sync_organization_members(oid, members=None):
+    # members not given are fetched from Logto before the mirror is read
+    if members is None:
+        members = fetch_member_uids(oid)
+    known = get_member_uids(oid)
+
+    added = members - known
+    for chunk in batched(added, UPSERT_BATCH_SIZE):
+        db.session.execute(insert(DirectoryMembership).values([
+            {"organization_id": oid, "uid": uid} for uid in chunk
+        ]).on_conflict_do_nothing())
+    removed = known - members
+    if removed:
+        db.session.execute(delete(DirectoryMembership).where(
+            DirectoryMembership.organization_id == oid,
+            DirectoryMembership.uid.in_(removed)
+        ))
+    return added, removed
+
+
+def get_member_uids(oid):
+    stmt = select(DirectoryMembership.uid).where(DirectoryMembership.organization_id == oid)
+    return set(db.session.execute(stmt).scalars().all())
+
+
+def get_organization_ids(uid):
+    stmt = select(DirectoryMembership.organization_id).where(DirectoryMembership.uid == uid)
+    return set(db.session.execute(stmt).scalars().all())
+
+
+def upsert_user(user):
+    upsert(DirectoryUser, [{
+        "id": user["id"],
+        "username": user.get("username"),
+        "updated_at": user.get("updatedAt"),
+        "data": user
+    }], ["username", "updated_at", "data"])
+
+
+def delete_user(uid):
+    db.session.execute(delete(DirectoryUser).where(DirectoryUser.id == uid))
+    db.session.execute(delete(DirectoryMembership).where(DirectoryMembership.uid == uid))
+
+
+def upsert_organization(org):
+    upsert(DirectoryOrganization, [{
+        "id": org["id"],
+        "name": org.get("name"),
+        "data": org
+    }], ["name", "data"])
+
+
+def delete_organization(oid):
+    db.session.execute(delete(DirectoryOrganization).where(DirectoryOrganization.id == oid))
+    db.session.execute(delete(DirectoryMembership).where(DirectoryMembership.organization_id == oid))
+
+
+def sync_directory():
+    users, organizations, members = fetch_directory()
+    # the writes below run in one short transaction, without Logto calls
+    users, user_keys = sync_users(users)
+    organizations, organization_keys = sync_organizations(organizations, members)
+    result = {
+        "users": users,
+        "organizations": organizations
+    }
+    # only the entries of what changed are dropped from the caches
+    bump_versions(user_keys + organization_keys)
+    stmt = insert(DirectorySyncState).values(name="directory", synced_at=datetime.now(timezone.utc))
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[DirectorySyncState.name],
+        set_={"synced_at": stmt.excluded.synced_at}
+    ))
+    db.session.commit()
+    return result
@@ -0,0 +1,80 @@
+from sqlalchemy import select, func
+from datetime import datetime, timezone, timedelta
+from flask import current_app
+from typing import Dict, Iterable, List
+
+
+import hashlib
+import hmac
+
+
+from common.cache import TTLCache, MISSING
+from directory.db import (
+    db,
+    DirectoryUser, DirectoryOrganization, DirectoryMembership, DirectorySyncState
+)
+
+
+# The mirror is only trusted while the last sync is younger than max_staleness
+MAX_STALENESS = 1800
+state_cache = TTLCache("directory", maxsize=1, ttl=60)
+
+
+def directory_ready() -> bool:
+    ready = state_cache.get("ready", MISSING)
+    if ready is MISSING:
+        max_staleness = current_app.config.get("DIRECTORY", {}).get("max_staleness", MAX_STALENESS)
+        synced_at = db.session.execute(
+            select(DirectorySyncState.synced_at).where(DirectorySyncState.name == "directory")
+        ).scalar_one_or_none()
+        ready = synced_at is not None and \
+            datetime.now(timezone.utc) - synced_at < timedelta(seconds=max_staleness)
+        state_cache.set("ready", ready)
+    return ready
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_users(prefix: str, limit=10) -> List[dict]:
+    stmt = select(DirectoryUser.data).where(
+        func.lower(DirectoryUser.username).like(f"{escape_like(prefix.lower())}%", escape="\\")
+    ).order_by(func.lower(DirectoryUser.username)).limit(limit)
+    return db.session.execute(stmt).scalars().all()
+
+
+def get_users(uids: Iterable[str]) -> Dict[str, dict]:
+    stmt = select(DirectoryUser.id, DirectoryUser.data).where(DirectoryUser.id.in_(list(uids)))
+    return dict(db.session.execute(stmt).tuples().all())
+
+
+def get_user_organizations(uid) -> List[dict] | None:
+    if db.session.get(DirectoryUser, uid) is None:
+        return None
+    stmt = select(DirectoryOrganization.data).join(
+        DirectoryMembership,
+        DirectoryMembership.organization_id == DirectoryOrganization.id
+    ).where(DirectoryMembership.uid == uid).order_by(DirectoryOrganization.name)
+    return db.session.execute(stmt).scalars().all()
+
+
+def get_organization_users(oid) -> List[dict] | None:
+    if db.session.get(DirectoryOrganization, oid) is None:
+        return None
+    stmt = select(DirectoryUser.data).join(
+        DirectoryMembership,
+        DirectoryMembership.uid == DirectoryUser.id
+    ).where(DirectoryMembership.organization_id == oid).order_by(DirectoryUser.username)
+    return db.session.execute(stmt).scalars().all()
+
+
+def sign_payload(signing_key: str, body: bytes) -> str:
+    # Logto signs the raw request body with HMAC-SHA256 (`logto-signature-sha-256`)
+    return hmac.new(signing_key.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(signing_key: str, body: bytes, signature: str | None) -> bool:
+    if not signing_key or not signature:
+        return False
+    return hmac.compare_digest(sign_payload(signing_key, body), signature)
@@ -7,6 +7,14 @@ class BaseElec(Base):
 
 
 class ElecBuilding(BaseElec):
+    __table_args__ = (
+        # one building per dormitory; also serves the drill-down in /elec/select
+        db.UniqueConstraint(
+            'area_id', 'apartment_id', 'floor_id', 'dormitory_id',
+            name='uq_elec_elec_building_location'
+        ),
+        BaseElec.__table_args__
+    )
     area_id = db.Column(db.String(32))
     area_name = db.Column(db.String(32))
     apartment_id = db.Column(db.String(32))
@@ -18,6 +26,10 @@ class ElecBuilding(BaseElec):
 
 
 class ElecStat(BaseElec):
+    __table_args__ = (
+        db.Index('ix_elec_elec_stat_building_id_search_time', 'building_id', 'search_time'),
+        BaseElec.__table_args__
+    )
     building_id = db.Column(db.Integer)
     search_time = db.Column(db.DateTime)
     surplus = db.Column(db.Numeric(precision=10, scale=2))
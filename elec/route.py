@@ -3,6 +3,7 @@ from datetime import datetime
 
 
 from common.auth import require_auth
+from common.version import ELEC_CATALOG, get_versions, etag, is_fresh, not_modified, with_etag
 from profile.db import Account
 from elec.db import db, ElecBuilding, ElecStat
 
@@ -49,11 +50,12 @@ def get_data():
     if user is None or user.bupt_id is None or user.bupt_password is None:
         return abort(403)
     
-    building_id = Account.query.filter(
-        Account.uid == uid
-    ).one().building_id
+    building_id = user.building_id
     start_time = request.args.get('start')
     end_time = request.args.get('end')
+    tag = etag("elec.info.data", building_id, get_versions(("building", building_id)), start_time, end_time)
+    if is_fresh(tag):
+        return not_modified(tag)
 
     start_dt = datetime.fromisoformat(start_time)
     end_dt = datetime.fromisoformat(end_time)
@@ -66,13 +68,17 @@ def get_data():
         ElecStat.surplus
     ).order_by(ElecStat.search_time).all()
 
-    return jsonify([(item[0].isoformat(), float(item[1])) for item in data])
+    return with_etag(jsonify([(item[0].isoformat(), float(item[1])) for item in data]), tag)
 
 
-@elec.route("/select", methods=['POST'])
+@elec.route("/select", methods=['GET', 'POST'])
 @require_auth
 def select_building():
-    data = request.get_json()
+    # GET takes the ids as query parameters and supports If-None-Match
+    data = request.get_json() if request.method == 'POST' else request.args.to_dict()
+    tag = etag("elec.select", get_versions(ELEC_CATALOG), data)
+    if is_fresh(tag):
+        return not_modified(tag)
     valid = lambda key: key not in data or not isinstance(data[key], str) or len(data[key]) == 0
     
     if valid('area_id'):
@@ -80,13 +86,13 @@ def select_building():
             ElecBuilding.area_id,
             ElecBuilding.area_name
         ).distinct().all()
-        return jsonify({
+        return with_etag(jsonify({
             "type": "area",
             "data": [{
                 'area_id': i.area_id,
                 'area_name': i.area_name
             } for i in areas]
-        })
+        }), tag)
     
     if valid('apartment_id'):
         apartment = ElecBuilding.query.with_entities(
@@ -95,13 +101,13 @@ def select_building():
         ).filter(
             ElecBuilding.area_id == data["area_id"]
         ).distinct().all()
-        return jsonify({
+        return with_etag(jsonify({
             "type": "apartment",
             "data": [{
                 'apartment_id': i.apartment_id,
                 'apartment_name': i.apartment_name
             } for i in apartment]
-        })
+        }), tag)
     
     if valid('floor_id'):
         floor = ElecBuilding.query.with_entities(
@@ -111,13 +117,13 @@ def select_building():
             ElecBuilding.area_id == data["area_id"],
             ElecBuilding.apartment_id == data["apartment_id"]
         ).distinct().all()
-        return jsonify({
+        return with_etag(jsonify({
             "type": "floor",
             "data": [{
                 'floor_id': i.floor_id,
                 'floor_name': i.floor_name
             } for i in floor]
-        })
+        }), tag)
     
     if valid('dormitory_id'):
         dormitory = ElecBuilding.query.with_entities(
@@ -128,13 +134,13 @@ def select_building():
             ElecBuilding.apartment_id == data["apartment_id"],
             ElecBuilding.floor_id == data["floor_id"]
         ).distinct().all()
-        return jsonify({
+        return with_etag(jsonify({
             "type": "dormitory",
             "data": [{
                 'dormitory_id': i.dormitory_id,
                 'dormitory_name': i.dormitory_name
             } for i in dormitory]
-        })
+        }), tag)
 
     return abort(404)
 
@@ -7,6 +7,10 @@ class BaseProfile(Base):
 
 
 class Account(BaseProfile):
+    __table_args__ = (
+        db.UniqueConstraint('uid', name='uq_profile_account_uid'),
+        BaseProfile.__table_args__
+    )
     uid = db.Column(db.String(32))
     building_id = db.Column(db.Integer)
     bupt_id = db.Column(db.Integer)
@@ -19,8 +19,12 @@ import os
 
 
 from common.db import db
+from common.logto import logto
+from common.version import bump_versions
 from profile.db import Account
 from elec.db import ElecBuilding, ElecStat
+from directory.sync import sync_directory
+from bill.archive import maintain, ARCHIVE_HORIZON_DAYS
 
 
 # runtime configuration
@@ -52,6 +56,10 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['database']['username']}:{config['database']['password']}@{config['database']['address']}/{config['database']['database']}"
 db.init_app(app)
 
+# logto
+app.config['LOGTO'] = config['logto']
+logto.init_app(app)
+
 
 def app_context(func):
     @wraps(func)
@@ -144,6 +152,7 @@ def fetch_and_store_elec_stats():
                 surplus=surplus
             )
             db.session.add(stat)
+            bump_versions([("building", bid)])
             db.session.commit()
             logger.info(f"Fetch stats for building {bid} successfully: surplus {surplus:.2f} @ {search_time}")
             
@@ -157,10 +166,37 @@ def fetch_and_store_elec_stats():
     logger.info(f"Successfully fetch {len(building_ids)} buildings.")
 
 
+@app_context
+def sync_logto_directory():
+    logger.info("Sync Logto directory.")
+    try:
+        result = sync_directory()
+    except Exception as e:
+        logger.error(f"Error when sync Logto directory: {e}")
+        db.session.rollback()
+        return
+    logger.info(f"Sync Logto directory successfully: {result}")
+
+
+@app_context
+def archive_bills():
+    logger.info("Archive bills.")
+    horizon_days = config.get('bill', {}).get('archive', {}).get('horizon_days', ARCHIVE_HORIZON_DAYS)
+    try:
+        archived = maintain(horizon_days)
+    except Exception as e:
+        logger.error(f"Error when archive bills: {e}")
+        db.session.rollback()
+        return
+    logger.info(f"Archive bills successfully: {archived} bills archived")
+
+
 if __name__ == "__main__":
     scheduler = BlockingScheduler()
     trigger = CronTrigger(minute="*/5")
     scheduler.add_job(fetch_and_store_elec_stats, trigger=trigger)
+    scheduler.add_job(sync_logto_directory, trigger=CronTrigger(minute="*/10"))
+    scheduler.add_job(archive_bills, trigger=CronTrigger(day=1, hour=4))
     logger.info("Start scheduler")
     try:
         scheduler.start()
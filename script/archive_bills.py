@@ -0,0 +1,32 @@
+# Create the coming bill partitions and move deleted and old fully paid bills
+# into the archive partitions. Pass --dry-run to only count the bills.
+
+from tomllib import load
+from flask import Flask
+
+
+import sys
+import os
+
+
+from bill.db import db
+from bill.archive import maintain, ARCHIVE_HORIZON_DAYS
+
+
+# runtime configuration
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+with open("./config.toml", "rb") as file:
+    config = load(file)
+
+
+# app configuration
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['database']['username']}:{config['database']['password']}@{config['database']['address']}/{config['database']['database']}"
+db.init_app(app)
+
+
+with app.app_context():
+    dry_run = "--dry-run" in sys.argv
+    horizon_days = config.get('bill', {}).get('archive', {}).get('horizon_days', ARCHIVE_HORIZON_DAYS)
+    archived = maintain(horizon_days, dry_run=dry_run)
+    print(f"{archived} bills" + (" to archive (dry run, nothing written)" if dry_run else " archived"))
@@ -0,0 +1,76 @@
+# Measure statements and latency of the bill write path against the
+# configured database. Every run is rolled back, nothing is kept.
+# Usage: python -m script.bench_create_bill [batch_size ...]
+
+from tomllib import load
+from flask import Flask
+from sqlalchemy import event
+from time import perf_counter
+
+
+import sys
+import os
+
+
+from bill.db import db
+from bill.util import insert_bills, compute_owed
+from bill.validate import ValidatedBill
+
+
+# runtime configuration
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+with open("./config.toml", "rb") as file:
+    config = load(file)
+
+
+# app configuration
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['database']['username']}:{config['database']['password']}@{config['database']['address']}/{config['database']['database']}"
+db.init_app(app)
+
+
+USERS = {f"bench{i}": {"id": f"bench{i}"} for i in range(4)}
+BILL = {
+    "title": "bench",
+    "trade_time": "2025-01-01T00:00:00+08:00",
+    "price": "100.00",
+    "party": "bench0",
+    "counterparty": list(USERS),
+    "apportion_method": "share",
+    "apportions": [{"user": uid, "value": "1"} for uid in USERS],
+    "as_apportion_preset": False
+}
+
+
+def bench(size, rounds=20):
+    # users come from the context so no Logto call is timed
+    bills = [ValidatedBill.model_validate(BILL, context={"users": USERS}) for _ in range(size)]
+    statements = []
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    timings = []
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        for _ in range(rounds):
+            statements.clear()
+            start = perf_counter()
+            insert_bills([(data, compute_owed(data)) for data in bills])
+            db.session.flush()
+            timings.append(perf_counter() - start)
+            db.session.rollback()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print(
+        f"{size:>5} bills | {len(statements)} statements | "
+        f"median {median * 1000:8.2f} ms, {median * 1000 / size:6.3f} ms/bill"
+    )
+
+
+with app.app_context():
+    for size in [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 1000]:
+        bench(size)
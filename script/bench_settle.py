@@ -0,0 +1,62 @@
+# Benchmark the settle-up engine on synthetic groups.
+# Usage: python -m script.bench_settle [members:bills ...]
+
+from decimal import Decimal
+from time import perf_counter
+
+
+import random
+import sys
+
+
+from bill.settle import net_positions, settle, CENT
+
+
+def synthetic_debts(members, bills, seed=0):
+    # Random bills among small subgroups, split evenly with the round-off
+    # going to one participant, like create_bill does
+    rng = random.Random(seed)
+    uids = [f"user{i}" for i in range(members)]
+    for _ in range(bills):
+        group = rng.sample(uids, min(members, rng.randint(2, 6)))
+        payer = rng.choice(group)
+        price = Decimal(rng.randint(100, 50000)) * CENT
+        share = (price / len(group)).quantize(CENT)
+        owed = {uid: share for uid in group}
+        owed[rng.choice(group)] += price - share * len(group)
+        for uid in group:
+            if uid != payer:
+                yield uid, payer, owed[uid]
+
+
+def bench(members, bills):
+    start = perf_counter()
+    debts = list(synthetic_debts(members, bills))
+    positions = net_positions(debts)
+    aggregate = perf_counter() - start
+
+    start = perf_counter()
+    transfers = settle(positions)
+    elapsed = perf_counter() - start
+
+    # applying the plan must clear every position exactly
+    remaining = dict(positions)
+    for debtor, creditor, amount in transfers:
+        remaining[debtor] -= amount
+        remaining[creditor] += amount
+    assert all(amount == 0 for amount in remaining.values())
+
+    pairs = len({(d, c) for d, c, _ in debts})
+    print(
+        f"{members:>6} members {bills:>7} bills | "
+        f"pairwise debts {pairs:>7} -> transfers {len(transfers):>5} | "
+        f"aggregate {aggregate * 1000:9.1f} ms, settle {elapsed * 1000:8.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    cases = [tuple(map(int, arg.split(":"))) for arg in sys.argv[1:]] or [
+        (10, 1000), (100, 10000), (1000, 100000), (5000, 300000)
+    ]
+    for members, bills in cases:
+        bench(members, bills)
@@ -1,4 +1,5 @@
 from sqlalchemy import text
+from datetime import datetime
 from tomllib import load
 from flask import Flask
 
@@ -10,6 +11,8 @@ from common.db import db
 from elec.db import *
 from profile.db import *
 from bill.db import *
+from directory.db import *
+from bill.archive import ensure_partitions
 
 
 # runtime configuration
@@ -38,7 +41,14 @@ with app.app_context():
     with db.engine.connect() as conn:
         for schema in schemas:
             conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+        # trigram index of bill search
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
         conn.commit()
 
     # create table
     db.create_all()
+
+    # partitions of the bill tables, later years are added by the scheduler
+    year = datetime.now().year
+    ensure_partitions([year, year + 1])
+    db.session.commit()
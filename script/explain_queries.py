@@ -0,0 +1,90 @@
+# EXPLAIN the hot-path queries against the configured database and check
+# that none of them needs a sequential scan. Sequential scans are disabled
+# for the check, since tiny development tables would otherwise always be
+# scanned; a Seq Scan in the plan then means no usable index exists.
+# Usage: python -m script.explain_queries [-v]
+
+from tomllib import load
+from flask import Flask
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, text
+
+
+import json
+import sys
+import os
+
+
+from bill.db import db, BillAmount, ApportionPreset, Balance
+from bill.util import bill_rows_query, search_bill_rows_query, outstanding_debts_query, changes_query
+from elec.db import ElecBuilding, ElecStat
+from profile.db import Account
+
+
+# runtime configuration
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+with open("./config.toml", "rb") as file:
+    config = load(file)
+
+
+# app configuration
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['database']['username']}:{config['database']['password']}@{config['database']['address']}/{config['database']['database']}"
+db.init_app(app)
+
+
+NOW = datetime.now(timezone.utc)
+QUERIES = {
+    "bill list": bill_rows_query("uid", limit=50),
+    "bill list page": bill_rows_query("uid", after=(NOW, 1000), limit=50),
+    "bill search": search_bill_rows_query("uid", "electricity", 50),
+    "bill amount": select(BillAmount).where(BillAmount.bill_id == 1, BillAmount.uid == "uid"),
+    "unpaid shares": outstanding_debts_query([1, 2, 3]),
+    "bill changes": changes_query("uid", (1000, 0), 2000, 200),
+    "balance": select(Balance).where(Balance.uid == "uid"),
+    "presets": select(ApportionPreset).where(ApportionPreset.oid.in_(["oid"])).order_by(ApportionPreset.id),
+    "account": select(Account).where(Account.uid == "uid"),
+    "building": select(ElecBuilding.id).where(
+        ElecBuilding.area_id == "a",
+        ElecBuilding.apartment_id == "b",
+        ElecBuilding.floor_id == "c",
+        ElecBuilding.dormitory_id == "d"
+    ),
+    "elec data": select(ElecStat.search_time, ElecStat.surplus).where(
+        ElecStat.building_id == 1,
+        ElecStat.search_time.between(NOW - timedelta(days=7), NOW)
+    ).order_by(ElecStat.search_time)
+}
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(stmt):
+    compiled = stmt.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+    result = db.session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+    return result.scalar()[0]["Plan"]
+
+
+with app.app_context():
+    db.session.execute(text("SET LOCAL enable_seqscan = off"))
+    failed = []
+    for name, stmt in QUERIES.items():
+        plan = explain(stmt)
+        scans = sorted({
+            f'{node["Node Type"]} on {node["Relation Name"]}'
+            for node in plan_nodes(plan) if "Relation Name" in node
+        })
+        seq = [scan for scan in scans if scan.startswith("Seq Scan")]
+        print(f"{'FAIL' if seq else 'ok':>4}  {name:<16} {', '.join(scans)}")
+        if "-v" in sys.argv:
+            print(json.dumps(plan, indent=2))
+        if seq:
+            failed.append(name)
+    db.session.rollback()
+
+    if failed:
+        sys.exit(f"sequential scans in: {', '.join(failed)}")
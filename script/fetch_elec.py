@@ -10,6 +10,7 @@ from random import random
 import os
 
 
+from common.version import ELEC_CATALOG, bump_versions
 from elec.db import db, ElecBuilding
 
 
@@ -107,5 +108,6 @@ with app.app_context():
             dormitory_name=i['drom']['dromName'],
         )
         db.session.add(line)
+    bump_versions([ELEC_CATALOG])
     db.session.commit()
     print("Adding completed.")
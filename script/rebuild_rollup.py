@@ -0,0 +1,33 @@
+# Recompute bill.monthly_rollup from the bill tables and report any drift.
+# Pass --dry-run to only report.
+
+from tomllib import load
+from flask import Flask
+
+
+import sys
+import os
+
+
+from bill.db import db
+from bill.util import rebuild_rollup
+
+
+# runtime configuration
+os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+with open("./config.toml", "rb") as file:
+    config = load(file)
+
+
+# app configuration
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{config['database']['username']}:{config['database']['password']}@{config['database']['address']}/{config['database']['database']}"
+db.init_app(app)
+
+
+with app.app_context():
+    dry_run = "--dry-run" in sys.argv
+    drift = rebuild_rollup(dry_run=dry_run)
+    for (uid, month, counterpart_uid), (stored, expected) in sorted(drift.items()):
+        print(f"{month:%Y-%m} {uid} / {counterpart_uid}: stored {stored}, expected {expected}")
+    print(f"{len(drift)} drifted rows" + (" (dry run, nothing written)" if dry_run else ", rollup rebuilt"))
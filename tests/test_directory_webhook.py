@@ -0,0 +1,244 @@
+from unittest import TestCase, main
+from unittest.mock import patch
+from flask import Flask
+
+
+import json
+
+
+from common import util
+from common.cache import MISSING
+from directory import route
+from directory.route import directory
+from directory.util import sign_payload
+
+
+SIGNING_KEY = "test-signing-key"
+
+
+class WebhookTest(TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["LOGTO"] = {"webhook": {"signingKey": SIGNING_KEY}}
+        self.app.register_blueprint(directory)
+        self.client = self.app.test_client()
+
+        # the mirror, its database and the version counters are mocked out
+        self.mocks = {}
+        for name in (
+            "get_organization_ids", "get_member_uids", "sync_organization_members",
+            "upsert_user", "delete_user", "upsert_organization", "delete_organization",
+            "bump_versions", "db"
+        ):
+            patcher = patch.object(route, name)
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        self.mocks["get_organization_ids"].return_value = ["o1"]
+        self.mocks["get_member_uids"].return_value = {"u1", "u2"}
+        self.mocks["sync_organization_members"].return_value = ({"u3"}, {"u2"})
+
+        # every cache holds an entry of directory version 1
+        for cache in (util.user_cache, util.organization_cache, util.member_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        for uid in ("u1", "u2", "u3"):
+            util.user_cache.set(uid, (1, {"id": uid}))
+            util.organization_cache.set(uid, (1, [{"id": "o1"}]))
+        util.member_cache.set("o1", (1, [{"id": "u1"}, {"id": "u2"}]))
+
+    def post(self, payload, signature=None):
+        body = json.dumps(payload).encode()
+        if signature is None:
+            signature = sign_payload(SIGNING_KEY, body)
+        return self.client.post(
+            "/directory/webhook",
+            data=body,
+            content_type="application/json",
+            headers={"logto-signature-sha-256": signature}
+        )
+
+    def assert_handled(self, response, users=(), organizations=(), members=()):
+        # only the versions of the entries dropped locally are bumped
+        self.assertEqual(response.status_code, 204)
+        self.mocks["bump_versions"].assert_called_once()
+        keys, = self.mocks["bump_versions"].call_args.args
+        self.assertEqual(sorted(keys), sorted(util.directory_keys(users, organizations, members)))
+        self.mocks["db"].session.commit.assert_called_once()
+
+    def test_valid_signature(self):
+        response = self.post({"event": "User.Data.Updated", "data": {"id": "u1", "username": "one"}})
+        self.assert_handled(response, {"u1"}, {"u1"}, {"o1"})
+
+    def test_bad_signature(self):
+        response = self.post({"event": "User.Deleted", "data": {"id": "u1"}}, signature="0" * 64)
+        self.assertEqual(response.status_code, 401)
+        self.mocks["delete_user"].assert_not_called()
+        self.mocks["bump_versions"].assert_not_called()
+        self.assertIsNotNone(util.user_cache.get("u1"))
+
+    def test_missing_signature(self):
+        body = json.dumps({"event": "User.Deleted", "data": {"id": "u1"}}).encode()
+        response = self.client.post("/directory/webhook", data=body, content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_signature_of_other_body(self):
+        signature = sign_payload(SIGNING_KEY, b"{}")
+        response = self.post({"event": "User.Deleted", "data": {"id": "u1"}}, signature=signature)
+        self.assertEqual(response.status_code, 401)
+
+    def test_unknown_event(self):
+        response = self.post({"event": "PostSignIn"})
+        self.assertEqual(response.status_code, 204)
+        self.mocks["bump_versions"].assert_not_called()
+
+    def assert_user_invalidated(self):
+        self.assertIsNone(util.user_cache.get("u1"))
+        self.assertIsNone(util.organization_cache.get("u1"))
+        self.assertIsNone(util.member_cache.get("o1"))
+        self.assertIsNotNone(util.user_cache.get("u2"))
+
+    def test_user_created(self):
+        response = self.post({"event": "User.Created", "data": {"id": "u1", "username": "one"}})
+        self.assert_handled(response, {"u1"}, {"u1"}, {"o1"})
+        self.mocks["upsert_user"].assert_called_once()
+        self.assert_user_invalidated()
+
+    def test_user_data_updated(self):
+        response = self.post({"event": "User.Data.Updated", "data": {"id": "u1", "username": "one"}})
+        self.assert_handled(response, {"u1"}, {"u1"}, {"o1"})
+        self.mocks["upsert_user"].assert_called_once()
+        self.assert_user_invalidated()
+
+    def test_user_suspension_updated(self):
+        response = self.post({"event": "User.SuspensionStatus.Updated", "params": {"userId": "u1"}})
+        self.assert_handled(response, {"u1"}, {"u1"}, {"o1"})
+        self.mocks["upsert_user"].assert_not_called()
+        self.assert_user_invalidated()
+
+    def test_user_deleted(self):
+        response = self.post({"event": "User.Deleted", "data": {"id": "u1"}})
+        self.assert_handled(response, {"u1"}, {"u1"}, {"o1"})
+        self.mocks["delete_user"].assert_called_once_with("u1")
+        self.assert_user_invalidated()
+
+    def assert_organization_invalidated(self, uids):
+        self.assertIsNone(util.member_cache.get("o1"))
+        for uid in ("u1", "u2", "u3"):
+            if uid in uids:
+                self.assertIsNone(util.organization_cache.get(uid))
+            else:
+                self.assertIsNotNone(util.organization_cache.get(uid))
+        self.assertIsNotNone(util.user_cache.get("u1"))
+
+    def test_organization_created(self):
+        response = self.post({"event": "Organization.Created", "data": {"id": "o1", "name": "Room"}})
+        self.assert_handled(response, organizations={"u1", "u2"}, members={"o1"})
+        self.mocks["upsert_organization"].assert_called_once()
+        self.assert_organization_invalidated({"u1", "u2"})
+
+    def test_organization_data_updated(self):
+        response = self.post({"event": "Organization.Data.Updated", "data": {"id": "o1", "name": "Room"}})
+        self.assert_handled(response, organizations={"u1", "u2"}, members={"o1"})
+        self.mocks["upsert_organization"].assert_called_once()
+        self.assert_organization_invalidated({"u1", "u2"})
+
+    def test_organization_deleted(self):
+        response = self.post({"event": "Organization.Deleted", "data": {"id": "o1"}})
+        self.assert_handled(response, organizations={"u1", "u2"}, members={"o1"})
+        self.mocks["delete_organization"].assert_called_once_with("o1")
+        self.assert_organization_invalidated({"u1", "u2"})
+
+    def test_organization_membership_updated(self):
+        response = self.post({"event": "Organization.Membership.Updated", "organizationId": "o1"})
+        self.assert_handled(response, organizations={"u1", "u2", "u3"}, members={"o1"})
+        self.mocks["sync_organization_members"].assert_called_once_with("o1")
+        # members before the change and those who joined
+        self.assert_organization_invalidated({"u1", "u2", "u3"})
+
+
+class DirectoryVersionTest(TestCase):
+    # A webhook only pops the caches of the worker receiving it; the others
+    # must ignore the entries of the keys it bumped, and only those.
+    def setUp(self):
+        self.app = Flask(__name__)
+        for cache in (util.member_cache, util.organization_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        self.versions = {}
+        patcher = patch.object(
+            util, "get_versions", side_effect=lambda *keys: [self.versions.get(key, 0) for key in keys]
+        )
+        self.get_versions = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mirror = {"o1": [{"id": "u1"}, {"id": "u2"}], "o2": [{"id": "u2"}]}
+        self.loads = []
+        for name, value in (
+            ("directory_ready", lambda: True),
+            ("get_organization_users", lambda oid: self.loads.append(oid) or self.mirror.get(oid)),
+            ("get_user_organizations", lambda uid: [
+                {"id": oid} for oid, members in self.mirror.items() if {"id": uid} in members
+            ])
+        ):
+            patcher = patch.object(util.directory, name, side_effect=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def bump(self, cache, key):
+        key = util.directory_key(cache, key)
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def members(self, oid="o1"):
+        # one request of another worker
+        with self.app.app_context():
+            return [user["id"] for user in util.get_organizations_member_by_id(oid)]
+
+    def test_entry_of_current_version_is_served(self):
+        self.assertEqual(self.members(), ["u1", "u2"])
+        self.mirror["o1"] = [{"id": "u1"}]
+        self.assertEqual(self.members(), ["u1", "u2"])
+
+    def test_bump_invalidates_every_worker(self):
+        self.assertEqual(self.members(), ["u1", "u2"])
+        # u2 leaves; the webhook is handled by a different worker
+        self.mirror["o1"] = [{"id": "u1"}]
+        self.bump(util.member_cache, "o1")
+        self.assertEqual(self.members(), ["u1"])
+
+    def test_bump_keeps_other_entries(self):
+        self.members("o1")
+        self.members("o2")
+        self.bump(util.member_cache, "o1")
+        self.loads.clear()
+        self.members("o1")
+        self.members("o2")
+        self.assertEqual(self.loads, ["o1"])
+
+    def test_user_organizations_follow_the_bump(self):
+        with self.app.app_context():
+            self.assertEqual(util.get_organizations_by_uid("u1"), [{"id": "o1"}])
+        self.mirror["o1"] = []
+        self.bump(util.organization_cache, "u1")
+        with self.app.app_context():
+            self.assertEqual(util.get_organizations_by_uid("u1"), [])
+
+    def test_versions_are_read_once_per_request(self):
+        with self.app.app_context():
+            util.get_organizations_members(["o1", "o2"])
+            util.get_organizations_member_by_id("o1")
+            self.assertEqual(util.read_directory_versions(), [
+                (util.directory_key(util.member_cache, "o1"), 0),
+                (util.directory_key(util.member_cache, "o2"), 0)
+            ])
+        self.assertEqual(self.get_versions.call_count, 1)
+
+    def test_entries_are_tagged_with_the_version(self):
+        self.bump(util.member_cache, "o1")
+        self.members()
+        self.assertEqual(util.member_cache.get("o1")[0], 1)
+        self.bump(util.member_cache, "o1")
+        with self.app.app_context():
+            self.assertIs(util.cache_get(util.member_cache, "o1"), MISSING)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from unittest import TestCase, main
+from decimal import Decimal
+
+
+import random
+
+
+from bill.settle import net_positions, settle, CENT
+
+
+def balances(transfers):
+    # net amount each user still owes once the transfers are paid
+    return net_positions((creditor, debtor, amount) for debtor, creditor, amount in transfers)
+
+
+class NetPositionsTest(TestCase):
+    def test_folds_debts_per_user(self):
+        positions = net_positions([
+            ("u1", "u2", Decimal("10.00")),
+            ("u3", "u2", Decimal("5.50")),
+            ("u2", "u1", Decimal("4.00")),
+        ])
+        self.assertEqual(positions, {
+            "u1": Decimal("6.00"),
+            "u2": Decimal("-11.50"),
+            "u3": Decimal("5.50"),
+        })
+
+    def test_sums_to_zero(self):
+        rng = random.Random(0)
+        uids = [f"u{i}" for i in range(20)]
+        debts = [
+            (*rng.sample(uids, 2), Decimal(rng.randint(1, 100000)) * CENT)
+            for _ in range(500)
+        ]
+        self.assertEqual(sum(net_positions(debts).values()), 0)
+
+
+class SettleTest(TestCase):
+    def assert_settles(self, positions):
+        transfers = settle(positions)
+        # paying the transfers clears every position, i.e. nothing is lost
+        remaining = balances(transfers)
+        for uid, amount in positions.items():
+            self.assertEqual(amount + remaining.get(uid, 0), 0, uid)
+        for debtor, creditor, amount in transfers:
+            self.assertGreater(amount, 0)
+            self.assertGreater(positions[debtor], 0)
+            self.assertLess(positions[creditor], 0)
+        return transfers
+
+    def test_conserves_money(self):
+        rng = random.Random(1)
+        for n in (2, 3, 10, 50):
+            uids = [f"u{i}" for i in range(n)]
+            debts = [
+                (*rng.sample(uids, 2), Decimal(rng.randint(1, 100000)) * CENT)
+                for _ in range(n * 5)
+            ]
+            self.assert_settles(net_positions(debts))
+
+    def test_at_most_n_minus_one_transfers(self):
+        rng = random.Random(2)
+        for n in (2, 3, 10, 50, 200):
+            uids = [f"u{i}" for i in range(n)]
+            debts = [
+                (*rng.sample(uids, 2), Decimal(rng.randint(1, 100000)) * CENT)
+                for _ in range(n * 5)
+            ]
+            positions = net_positions(debts)
+            transfers = self.assert_settles(positions)
+            self.assertLessEqual(len(transfers), sum(1 for a in positions.values() if a != 0) - 1)
+
+    def test_one_creditor(self):
+        transfers = self.assert_settles({
+            "u1": Decimal("-30.00"),
+            "u2": Decimal("10.00"),
+            "u3": Decimal("20.00"),
+        })
+        self.assertEqual(sorted(transfers), [
+            ("u2", "u1", Decimal("10.00")),
+            ("u3", "u1", Decimal("20.00")),
+        ])
+
+    def test_all_settled(self):
+        self.assertEqual(settle({}), [])
+        self.assertEqual(settle({"u1": Decimal("0"), "u2": Decimal("0.00")}), [])
+
+    def test_creditors_only(self):
+        # positions that cannot all be paid back are rejected, not half settled
+        with self.assertRaises(ValueError):
+            settle({"u1": Decimal("-5.00"), "u2": Decimal("-5.00")})
+
+    def test_rounds_to_the_cent(self):
+        transfers = settle({"u1": Decimal("1.005"), "u2": Decimal("-1.005")})
+        self.assertEqual(transfers, [("u1", "u2", Decimal("1.01"))])
+        self.assertEqual(transfers[0][2].as_tuple().exponent, -2)
+
+    def test_drops_sub_cent_positions(self):
+        self.assertEqual(settle({"u1": Decimal("0.004"), "u2": Decimal("-0.004")}), [])
+
+    def test_rejects_rounding_that_breaks_zero_sum(self):
+        # two thirds of 10.00 each rounded up no longer match the 6.67 owed
+        with self.assertRaises(ValueError):
+            settle({
+                "u1": Decimal("3.335"),
+                "u2": Decimal("3.335"),
+                "u3": Decimal("-6.67"),
+            })
+
+
+if __name__ == "__main__":
+    main()